@@ -0,0 +1,393 @@
+""" sparse, rank-based mutual affinity wrt., L, as per affinities_for_row and
+affinities_for_column of examine_llrs.ipynb
+
+For a nonzero (i, j) of L, where L[i, j] > cutoff:
+    Rr = 1 + the number of cols c of row i, s.t., L[i, c] > L[i, j]
+    Rc = 1 + the number of rows r of col j, s.t., L[r, j] > L[i, j]
+    Nc = the number of cols of row i above cutoff, i.e., L[i, c] > cutoff
+    Nr = the number of rows of col j above cutoff, i.e., L[r, j] > cutoff
+    Mr = 1 - (Rr - 1) / Nc
+    Mc = 1 - (Rc - 1) / Nr
+    mutual affinity = Mr * Mc
+
+Rr and Rc do not depend on the cutoff (i.e., only entries above cutoff can be greater than
+one above cutoff), hence are computed once, by sorting the nonzeros per row and per col.
+Nc and Nr are then counts (per cutoff) over the sorted values, s.t., the affinities of a
+row or col are read off in O(nonzeros log nonzeros) of that row or col, and of the whole
+matrix in one vectorized sweep.
+
+E.g.,
+    A = Affinity(L)
+    A.for_row(noun2i["man"], cutoff=0)  # as per affinities_for_row(i, L, cutoff=0)
+    A.matrix(cutoff=0)  # i.e., the mutual affinity of each nonzero of L above cutoff
+
+Note: cutoff >= 0, i.e., L's implicit zeros are never above cutoff
+Note: nan llr are never above cutoff, nor greater than any llr, as per the notebook
+
+Note: Affinity holds L, and its ranks, in memory, i.e., ~8 arrays of L's nonzeros
+
+Batch mode, i.e., for each switched-on config and role, the mutual affinity matrix wrt., L
+for each cutoff, computed over blocks of rows in config["n_workers"] processes, and saved
+next to L in L's format, i.e., <role>/affinity_profiles_<cutoff>.npz (else a CSR dir, see
+blocked.py), s.t., the affinity of a (noun, feature) pair is M[noun2i[noun], feature2j[feature]].
+Where L is a CSR dir, it is never loaded whole (see save_matrices_blocked): Rr is ranked per
+block of rows of L, Rc per block of rows of its blocked transpose (written back via
+memory-mapped arrays), and Nc and Nr are counted in one streamed pass.
+run:
+    python3 affinity.py --cutoffs 0 1 5
+"""
+
+import argparse
+import json
+import pathlib
+import shutil
+import sys
+import typing
+from multiprocessing import Pool
+
+import numpy as np
+from scipy.sparse import csr_matrix, load_npz, save_npz
+from tqdm import tqdm
+
+import blocked
+import llr
+
+# i.e., nonzeros of L per block of rows, in batch mode
+BLOCK_NNZ = 2**20
+
+# i.e., the Affinity of L, per worker, see init_worker
+_worker = {}
+
+
+def main(args):
+
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--cutoffs", type=float, nargs="+", default=[0])
+    parser.add_argument("--block-nnz", type=int, default=BLOCK_NNZ, help="nonzeros per block of rows")
+    args = parser.parse_args(args)
+
+    # load configs
+    with open("configs.json", "r", encoding="utf-8") as f:
+        configs = json.load(f)
+
+    for config in configs:
+        if config["switch"]:
+            output_dir = pathlib.Path(config["output_dir"]).expanduser().resolve()
+            n_workers = int(config.get("n_workers", 1))
+
+            for role in llr.ROLES:
+                save_dir = output_dir / role
+
+                print(f"role:{role}, mutual affinities wrt., cutoffs {args.cutoffs}")
+                if (save_dir / "llr_profiles.npz").exists():
+                    L = load_npz(save_dir / "llr_profiles.npz")
+                    matrices = get_matrices(L, args.cutoffs, block_nnz=args.block_nnz, n_workers=n_workers)
+                    for cutoff, M in matrices.items():
+                        save_npz(save_dir / f"affinity_profiles_{cutoff:g}.npz", M)
+                else:
+                    save_matrices_blocked(
+                        save_dir / "llr_profiles", save_dir, args.cutoffs, block_nnz=args.block_nnz, n_workers=n_workers
+                    )
+
+
+def get_matrices(
+    L: csr_matrix, cutoffs: list[float], *, block_nnz: int = BLOCK_NNZ, n_workers: int = 1
+) -> dict[float, csr_matrix]:
+    """Return {cutoff: mutual affinity matrix} wrt., L, computed over blocks of rows of
+    (at most) block_nnz nonzeros, in n_workers processes."""
+    for cutoff in cutoffs:
+        check_cutoff(cutoff)
+    A = Affinity(L)
+    tasks = [(cutoff, r0, r1) for cutoff in cutoffs for r0, r1 in blocked.get_blocks(A.indptr, block_nnz)]
+
+    if n_workers == 1:
+        init_worker(A)
+        results = [get_block(task) for task in tqdm(tasks)]
+    else:
+        with Pool(n_workers, initializer=init_worker, initargs=(A,)) as pool:
+            results = list(tqdm(pool.imap(get_block, tasks), total=len(tasks)))
+
+    # i.e., in order of blocks, per cutoff
+    matrices = {}
+    for cutoff in cutoffs:
+        blocks = [(k, values) for cutoff_, k, values in results if cutoff_ == cutoff]
+        matrices[cutoff] = A.to_csr(
+            np.concatenate([k for k, _ in blocks]), np.concatenate([values for _, values in blocks])
+        )
+    return matrices
+
+
+def init_worker(A: "Affinity"):
+    _worker["affinity"] = A
+
+
+def get_block(task: tuple) -> tuple:
+    """Return (cutoff, k, mutual affinity) wrt., the block of rows of the task, see
+    Affinity.get_values."""
+    cutoff, r0, r1 = task
+    return (cutoff, *_worker["affinity"].get_values(cutoff, r0, r1))
+
+
+def save_matrices_blocked(
+    L_dir: pathlib.Path,
+    save_dir: pathlib.Path,
+    cutoffs: list[float],
+    *,
+    block_nnz: int = BLOCK_NNZ,
+    n_workers: int = 1,
+):
+    """Save the mutual affinity matrix wrt., the CSR dir L_dir, per cutoff, as the CSR dir
+    save_dir/affinity_profiles_<cutoff>, over blocks of rows of (at most) block_nnz nonzeros,
+    in n_workers processes, as per get_matrices.
+
+    Note: peak memory is ~a block per worker, plus Nc and Nr, i.e., O(nouns + features)
+    """
+    for cutoff in cutoffs:
+        check_cutoff(cutoff)
+    data, indices, indptr, shape = blocked.open_csr(L_dir)
+    blocks = blocked.get_blocks(indptr, block_nnz)
+
+    # i.e., Rc of each nonzero of L, ranked per block of cols
+    tmp_dir = save_dir / "affinity.tmp"
+    T_dir = blocked.transpose_csr(L_dir, tmp_dir / "T", block_nnz=block_nnz, positions=True)
+    np.lib.format.open_memmap(tmp_dir / "Rc.npy", mode="w+", dtype=np.int64, shape=data.shape)
+    T_blocks = blocked.get_blocks(np.load(T_dir / "indptr.npy", mmap_mode="r"), block_nnz)
+    map_blocks(compute_col_ranks, (T_dir, tmp_dir / "Rc.npy"), T_blocks, n_workers=n_workers)
+
+    # i.e., (Nc, Nr) per cutoff
+    counts = {cutoff: (np.zeros(shape[0], dtype=np.int64), np.zeros(shape[1], dtype=np.int64)) for cutoff in cutoffs}
+    for r0, r1 in blocks:
+        lo, hi = indptr[r0], indptr[r1]
+        values, cols = np.asarray(data[lo:hi]), np.asarray(indices[lo:hi])
+        rows = np.repeat(np.arange(r0, r1), np.diff(indptr[r0 : r1 + 1]))
+        for cutoff, (Nc, Nr) in counts.items():
+            above = values > cutoff
+            Nc += np.bincount(rows[above], minlength=shape[0])
+            Nr += np.bincount(cols[above], minlength=shape[1])
+
+    M_dirs = {}
+    for cutoff, (Nc, _) in counts.items():
+        M_dir = M_dirs[cutoff] = save_dir / f"affinity_profiles_{cutoff:g}"
+        M_dir.mkdir(parents=True, exist_ok=True)
+        M_indptr = np.zeros(shape[0] + 1, dtype=np.int64)
+        np.cumsum(Nc, out=M_indptr[1:])
+        np.save(M_dir / "indptr.npy", M_indptr)
+        np.save(M_dir / "shape.npy", np.array(shape, dtype=np.int64))
+        np.lib.format.open_memmap(M_dir / "data.npy", mode="w+", dtype=np.float64, shape=(int(M_indptr[-1]),))
+        np.lib.format.open_memmap(M_dir / "indices.npy", mode="w+", dtype=indices.dtype, shape=(int(M_indptr[-1]),))
+
+    map_blocks(compute_affinity_blocks, (L_dir, tmp_dir / "Rc.npy", M_dirs, counts), blocks, n_workers=n_workers)
+    shutil.rmtree(tmp_dir)
+
+
+def map_blocks(function: typing.Callable, args: tuple, blocks: list[tuple], *, n_workers: int = 1):
+    """Call function(*args, blocks_) over the blocks, i.e., in n_workers processes, each
+    owning a contiguous range of blocks, as per blocked.get_llr_blocked."""
+    if n_workers == 1:
+        function(*args, tqdm(blocks))
+    else:
+        ranges = [list(blocks_) for blocks_ in np.array_split(np.array(blocks), n_workers)]
+        with Pool(n_workers) as pool:
+            pool.starmap(function, [(*args, blocks_) for blocks_ in ranges if len(blocks_) > 0])
+
+
+def compute_col_ranks(T_dir: pathlib.Path, Rc_fp: pathlib.Path, blocks: typing.Iterable):
+    """Write Rc of each nonzero of the given blocks of rows of T_dir (i.e., of cols of L,
+    see blocked.transpose_csr) into Rc_fp, at its position wrt., L."""
+    data, _, indptr, _ = blocked.open_csr(T_dir)
+    positions = np.load(T_dir / "positions.npy", mmap_mode="r")
+    Rc = np.load(Rc_fp, mmap_mode="r+")
+
+    for r0, r1 in blocks:
+        lo, hi = indptr[r0], indptr[r1]
+        values = np.asarray(data[lo:hi])
+        cols = np.repeat(np.arange(r1 - r0), np.diff(indptr[r0 : r1 + 1]))
+        order = np.lexsort((-values, cols))
+        ranks = np.empty(hi - lo, dtype=np.int64)
+        ranks[order] = get_ranks(cols[order], values[order])
+        Rc[positions[lo:hi]] = ranks
+
+    Rc.flush()
+
+
+def compute_affinity_blocks(
+    L_dir: pathlib.Path, Rc_fp: pathlib.Path, M_dirs: dict, counts: dict, blocks: typing.Iterable
+):
+    """Write the mutual affinity of each nonzero above cutoff, of the given blocks of rows of
+    L_dir, into the CSR dir M_dirs[cutoff], given counts[cutoff], i.e., (Nc, Nr)."""
+    data, indices, indptr, _ = blocked.open_csr(L_dir)
+    Rc = np.load(Rc_fp, mmap_mode="r")
+    outputs = {
+        cutoff: (
+            np.load(M_dir / "indptr.npy", mmap_mode="r"),
+            np.load(M_dir / "indices.npy", mmap_mode="r+"),
+            np.load(M_dir / "data.npy", mmap_mode="r+"),
+        )
+        for cutoff, M_dir in M_dirs.items()
+    }
+
+    for r0, r1 in blocks:
+        lo, hi = indptr[r0], indptr[r1]
+        values, cols = np.asarray(data[lo:hi]), np.asarray(indices[lo:hi])
+        rows = np.repeat(np.arange(r0, r1), np.diff(indptr[r0 : r1 + 1]))
+        order = np.lexsort((-values, rows))
+        Rr = np.empty(hi - lo, dtype=np.int64)
+        Rr[order] = get_ranks(rows[order], values[order])
+        Rc_ = np.asarray(Rc[lo:hi])
+
+        for cutoff, (M_indptr, M_indices, M_data) in outputs.items():
+            Nc, Nr = counts[cutoff]
+            k = np.flatnonzero(values > cutoff)
+            out_lo, out_hi = M_indptr[r0], M_indptr[r1]
+            M_indices[out_lo:out_hi] = cols[k]
+            M_data[out_lo:out_hi] = (1 - (Rr[k] - 1) / Nc[rows[k]]) * (1 - (Rc_[k] - 1) / Nr[cols[k]])
+
+    for _, M_indices, M_data in outputs.values():
+        M_indices.flush()
+        M_data.flush()
+
+
+class Affinity:
+    def __init__(self, L: csr_matrix):
+        """Precompute the within-row and within-col ranks of the nonzeros of L."""
+        L = csr_matrix(L)
+        L.sum_duplicates()
+        self.shape = L.shape
+        self.indptr = L.indptr
+        self.indices = L.indices
+        self.data = L.data
+        self.rows = np.repeat(np.arange(L.shape[0]), np.diff(L.indptr))
+
+        # per row, the nonzeros by descending llr (nan last), and their ranks Rr
+        self.row_order = np.lexsort((-self.data, self.rows))
+        self.Rr = np.empty(L.nnz, dtype=np.int64)
+        self.Rr[self.row_order] = get_ranks(self.rows[self.row_order], self.data[self.row_order])
+
+        # per col, as per rows, i.e., Rc
+        self.col_order = np.lexsort((-self.data, self.indices))
+        self.col_indptr = np.zeros(L.shape[1] + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.indices, minlength=L.shape[1]), out=self.col_indptr[1:])
+        self.Rc = np.empty(L.nnz, dtype=np.int64)
+        self.Rc[self.col_order] = get_ranks(self.indices[self.col_order], self.data[self.col_order])
+
+        # i.e., the sorted (descending) values of each row and col
+        self.row_sorted = self.data[self.row_order]
+        self.col_sorted = self.data[self.col_order]
+
+        self.counts: dict[float, tuple] = {}  # i.e., per cutoff, see get_counts
+
+    def for_row(self, i: int, cutoff: float = 0) -> list[tuple]:
+        """Return [(col, llr, mutual affinity, Rr, Nc, Rc, Nr), ...] wrt., the cols of row i
+        above cutoff, by descending mutual affinity (ties by col), as per affinities_for_row."""
+        check_cutoff(cutoff)
+        lo, hi = self.indptr[i], self.indptr[i + 1]
+        k = np.arange(lo, hi)[self.data[lo:hi] > cutoff]
+        cols = self.indices[k]
+
+        Nc = len(k)
+        Nr = self.get_col_counts(cols, cutoff)
+        affinity = (1 - (self.Rr[k] - 1) / Nc) * (1 - (self.Rc[k] - 1) / Nr)
+
+        order = np.lexsort((cols, -affinity))
+        return list(
+            zip(cols[order], self.data[k][order], affinity[order], self.Rr[k][order], [Nc] * Nc, self.Rc[k][order], Nr[order])
+        )
+
+    def for_column(self, j: int, cutoff: float = 0) -> list[tuple]:
+        """Return [(row, llr, mutual affinity, Rr, Nc, Rc, Nr), ...] wrt., the rows of col j
+        above cutoff, by descending mutual affinity (ties by row), as per affinities_for_column."""
+        check_cutoff(cutoff)
+        lo, hi = self.col_indptr[j], self.col_indptr[j + 1]
+        k = self.col_order[lo:hi]
+        k = np.sort(k[self.data[k] > cutoff])  # i.e., in row order
+        rows = self.rows[k]
+
+        Nr = len(k)
+        Nc = self.get_row_counts(rows, cutoff)
+        affinity = (1 - (self.Rr[k] - 1) / Nc) * (1 - (self.Rc[k] - 1) / Nr)
+
+        order = np.lexsort((rows, -affinity))
+        return list(
+            zip(rows[order], self.data[k][order], affinity[order], self.Rr[k][order], Nc[order], self.Rc[k][order], [Nr] * Nr)
+        )
+
+    def matrix(self, cutoff: float = 0) -> csr_matrix:
+        """Return the mutual affinity of each nonzero of L above cutoff, as a csr_matrix
+        of L's shape."""
+        k, affinity = self.get_values(cutoff, 0, self.shape[0])
+        return self.to_csr(k, affinity)
+
+    def get_values(self, cutoff: float, r0: int, r1: int) -> tuple[np.ndarray, np.ndarray]:
+        """Return (k, mutual affinity), i.e., of each nonzero k (i.e., wrt., L.data) of rows
+        [r0, r1) above cutoff."""
+        check_cutoff(cutoff)
+        Nc, Nr = self.get_counts(cutoff)
+        lo, hi = self.indptr[r0], self.indptr[r1]
+        k = lo + np.flatnonzero(self.data[lo:hi] > cutoff)
+        rows, cols = self.rows[k], self.indices[k]
+        return k, (1 - (self.Rr[k] - 1) / Nc[rows]) * (1 - (self.Rc[k] - 1) / Nr[cols])
+
+    def get_counts(self, cutoff: float) -> tuple[np.ndarray, np.ndarray]:
+        """Return (Nc, Nr), i.e., the number of nonzeros above cutoff per row and per col."""
+        if cutoff not in self.counts:
+            above = self.data > cutoff
+            self.counts[cutoff] = (
+                np.bincount(self.rows[above], minlength=self.shape[0]),
+                np.bincount(self.indices[above], minlength=self.shape[1]),
+            )
+        return self.counts[cutoff]
+
+    def to_csr(self, k: np.ndarray, values: np.ndarray) -> csr_matrix:
+        """Return a csr_matrix of L's shape, holding values at the nonzeros k of L."""
+        M = csr_matrix((values, (self.rows[k], self.indices[k])), shape=self.shape)
+        M.sort_indices()
+        return M
+
+    def get_row_counts(self, rows: np.ndarray, cutoff: float) -> np.ndarray:
+        """Return the number of nonzeros above cutoff of each of rows."""
+        return np.array(
+            [count_above(self.row_sorted[self.indptr[r] : self.indptr[r + 1]], cutoff) for r in rows],
+            dtype=np.int64,
+        )
+
+    def get_col_counts(self, cols: np.ndarray, cutoff: float) -> np.ndarray:
+        """Return the number of nonzeros above cutoff of each of cols."""
+        return np.array(
+            [count_above(self.col_sorted[self.col_indptr[c] : self.col_indptr[c + 1]], cutoff) for c in cols],
+            dtype=np.int64,
+        )
+
+
+def get_ranks(groups: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """Return 1 + the number of values of the same group strictly greater than each value,
+    where values are sorted by group, then descending (nan last)."""
+    n = len(values)
+    positions = np.arange(n)
+    if n == 0:
+        return positions
+    group_starts = np.r_[0, np.flatnonzero(np.diff(groups)) + 1]
+    starts = np.zeros(n, dtype=np.int64)
+    starts[group_starts] = group_starts
+    starts = np.maximum.accumulate(starts)
+
+    # i.e., the first position of each run of equal values, within a group
+    new_run = np.ones(n, dtype=bool)
+    new_run[1:] = (groups[1:] != groups[:-1]) | (values[1:] != values[:-1])
+    run_starts = np.maximum.accumulate(np.where(new_run, positions, 0))
+    return run_starts - starts + 1
+
+
+def count_above(descending: np.ndarray, cutoff: float) -> int:
+    """Return the number of values above cutoff, of values sorted descending (nan last)."""
+    return int(np.searchsorted(-descending, -cutoff, side="left"))
+
+
+def check_cutoff(cutoff: float):
+    if cutoff < 0:
+        raise ValueError(f"cutoff {cutoff} < 0, i.e., the implicit zeros of L would be above cutoff")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,122 @@
+""" benchmark building the frequency matrices F (see llr.ingest), and the llr matrix L
+(see llr.get_llr), against tuple count
+
+Writes synthetic tuple outputs (Zipf-distributed nouns and features, see
+Tuples/tuple_output.py) to a temp dir, and times:
+    * ingest: reading the outputs, vocabularies and the COO-batched build of F (all roles)
+    * lil: the previous build, i.e., F[i, j] += 1 per tuple (for up to --lil-max tuples)
+    * llr: the vectorized L wrt., the adj F
+    * per-row: L row by row, via llr.get_llr_profile (for up to --lil-max tuples), and the
+      max abs difference to the vectorized L
+
+run:
+    python3 benchmark.py --sizes 100000 1000000 10000000
+"""
+
+import argparse
+import pathlib
+import sys
+import tempfile
+import time
+
+import numpy as np
+import orjson
+from scipy.sparse import csr_matrix, lil_matrix, vstack
+
+import llr
+
+TUPLES_PER_BOOK = 100_000
+
+
+def main(args):
+
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10**5, 10**6, 10**7])
+    parser.add_argument("--lil-max", type=int, default=10**5, help="largest size timed wrt., lil")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(args)
+
+    print("tuples\tnnz(adj)\tingest s\tlil s\tllr s\tper-row s\tmax diff")
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            fps = write_outputs(pathlib.Path(tmp_dir), size, seed=args.seed)
+
+            start = time.perf_counter()
+            ingested = llr.ingest(fps)
+            ingest_seconds = time.perf_counter() - start
+
+            if size <= args.lil_max:
+                start = time.perf_counter()
+                build_lil(fps)
+                lil_seconds = f"{time.perf_counter() - start:.2f}"
+            else:
+                lil_seconds = "-"
+
+        F = ingested["adj"][2]
+        start = time.perf_counter()
+        L = llr.get_llr(F)
+        llr_seconds = time.perf_counter() - start
+
+        if size <= args.lil_max:
+            start = time.perf_counter()
+            L_rows = vstack([llr.get_llr_profile(i, F) for i in range(F.shape[0])])
+            row_seconds = f"{time.perf_counter() - start:.2f}"
+            max_diff = f"{abs(L - L_rows).max():.2e}"
+        else:
+            row_seconds = max_diff = "-"
+
+        print(
+            f"{size}\t{F.nnz}\t{ingest_seconds:.2f}\t{lil_seconds}"
+            f"\t{llr_seconds:.4f}\t{row_seconds}\t{max_diff}"
+        )
+
+
+def write_outputs(out_dir: pathlib.Path, n_tuples: int, *, seed: int = 0) -> list[pathlib.Path]:
+    """Write n_tuples synthetic tuples, as outputs of TUPLES_PER_BOOK tuples each."""
+    rng = np.random.default_rng(seed)
+    fps = []
+    for book_i, start in enumerate(range(0, n_tuples, TUPLES_PER_BOOK)):
+        n = min(TUPLES_PER_BOOK, n_tuples - start)
+        nouns = [f"noun{x}" for x in rng.zipf(1.5, n) % 50_000]
+        features = [f"feature{x}" for x in rng.zipf(1.5, n) % 20_000]
+        roles = rng.choice(llr.ROLES, n).tolist()
+
+        string2i = {}
+        cols = {
+            col: [string2i.setdefault(s, len(string2i)) for s in strings]
+            for col, strings in [("noun", nouns), ("feature", features), ("role", roles)]
+        }
+        cols["pattern"] = [string2i.setdefault("P", len(string2i))] * n
+
+        fp = out_dir / f"{book_i}.jsonl"
+        with open(fp, "wb") as f:
+            f.write(orjson.dumps({"format": "tuples", "version": 1, "book": str(book_i)}) + b"\n")
+            f.write(orjson.dumps({"n_rows": n, "strings": list(string2i), **cols}) + b"\n")
+            f.write(orjson.dumps({"n_rows": n, "n_row_groups": 1}) + b"\n")
+        fps.append(fp)
+    return fps
+
+
+def build_lil(fps: list[pathlib.Path]) -> dict:
+    """Return {role: F} as per the previous build, i.e., dict vocabularies, then
+    F[i, j] += 1 per tuple."""
+    tuples = list(llr.gen_tuples(fps))
+    Fs = {}
+    for role in llr.ROLES:
+        noun2i, feature2j = {}, {}
+        for noun, feature, role_, *_ in tuples:
+            if role_ == role:
+                noun2i.setdefault(noun, len(noun2i))
+                feature2j.setdefault(feature, len(feature2j))
+        F = lil_matrix((len(noun2i), len(feature2j)), dtype=int)
+        for noun, feature, role_, *_ in tuples:
+            if role_ == role:
+                F[noun2i[noun], feature2j[feature]] += 1
+        Fs[role] = csr_matrix(F)
+    return Fs
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
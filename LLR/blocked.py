@@ -0,0 +1,187 @@
+""" out-of-core, blocked llr, for matrices larger than RAM
+
+F and L are saved as memory-mapped CSR dirs, i.e., <dir>/data.npy, indices.npy,
+indptr.npy and shape.npy. L is computed block by block, i.e., over ranges of rows of F
+(streamed from disk) holding at most block_mb worth of nonzeros, given the global column
+sums of F, and written into a memory-mapped L.
+
+Note: L has the sparsity of F, incl., any (explicit) llr of exactly 0
+Note: peak memory is ~block_mb per worker, plus the column sums and F's indptr, i.e.,
+O(features + nouns), not O(nonzeros)
+
+E.g., enable via "llr_block_mb" (and, optionally, "n_workers") in configs.json, or
+    L = blocked.load_csr(blocked.get_llr_blocked(F_dir, L_dir, block_mb=512, n_workers=4))
+"""
+
+import pathlib
+import shutil
+import typing
+from multiprocessing import Pool
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from tqdm import tqdm
+
+from llr import get_llr_values
+
+# approximate peak bytes per nonzero of a block, incl., temporaries of get_llr_values
+BYTES_PER_NNZ = 160
+
+
+def save_csr(csr_dir: pathlib.Path, M: csr_matrix):
+    """Save M as a memory-mappable CSR dir."""
+    csr_dir.mkdir(parents=True, exist_ok=True)
+    M = csr_matrix(M)
+    M.sort_indices()
+    np.save(csr_dir / "data.npy", M.data)
+    np.save(csr_dir / "indices.npy", M.indices)
+    np.save(csr_dir / "indptr.npy", M.indptr)
+    np.save(csr_dir / "shape.npy", np.array(M.shape, dtype=np.int64))
+
+
+def open_csr(csr_dir: pathlib.Path, *, mode: str = "r") -> tuple:
+    """Return the (data, indices, indptr, shape) of the CSR dir, as memory-maps."""
+    return (
+        np.load(csr_dir / "data.npy", mmap_mode=mode),
+        np.load(csr_dir / "indices.npy", mmap_mode="r"),
+        np.load(csr_dir / "indptr.npy", mmap_mode="r"),
+        tuple(np.load(csr_dir / "shape.npy")),
+    )
+
+
+def load_csr(csr_dir: pathlib.Path) -> csr_matrix:
+    """Return the CSR dir as a csr_matrix, backed by the memory-maps."""
+    data, indices, indptr, shape = open_csr(csr_dir)
+    return csr_matrix((data, indices, indptr), shape=shape, copy=False)
+
+
+def get_blocks(indptr: np.ndarray, block_nnz: int) -> list[tuple[int, int]]:
+    """Return contiguous (row_start, row_end) blocks, each of at most block_nnz nonzeros
+    (or a single row)."""
+    blocks = []
+    n_rows = len(indptr) - 1
+    r0 = 0
+    while r0 < n_rows:
+        r1 = int(np.searchsorted(indptr, indptr[r0] + block_nnz, side="right")) - 1
+        r1 = min(max(r1, r0 + 1), n_rows)
+        blocks.append((r0, r1))
+        r0 = r1
+    return blocks
+
+
+def get_block_nnz(block_mb: float) -> int:
+    """Return the nonzeros per block of rows, s.t., a block takes ~block_mb."""
+    return max(1, int(block_mb * 2**20 / BYTES_PER_NNZ))
+
+
+def transpose_csr(
+    csr_dir: pathlib.Path, T_dir: pathlib.Path, *, block_nnz: int, positions: bool = False
+) -> pathlib.Path:
+    """Save the transpose of the CSR dir csr_dir as the CSR dir T_dir, block by block of
+    rows, i.e., a counting sort of the nonzeros by col into memory-mapped arrays, s.t., the
+    rows of each col are in order. If positions, T_dir/positions.npy holds the index of each
+    nonzero wrt., the data of csr_dir. Return T_dir.
+
+    Note: peak memory is ~a block, plus O(rows + cols)
+    """
+    data, indices, indptr, shape = open_csr(csr_dir)
+    blocks = get_blocks(indptr, block_nnz)
+
+    col_counts = np.zeros(shape[1], dtype=np.int64)
+    for r0, r1 in blocks:
+        col_counts += np.bincount(indices[indptr[r0] : indptr[r1]], minlength=shape[1])
+    T_indptr = np.zeros(shape[1] + 1, dtype=np.int64)
+    np.cumsum(col_counts, out=T_indptr[1:])
+
+    T_dir.mkdir(parents=True, exist_ok=True)
+    np.save(T_dir / "indptr.npy", T_indptr)
+    np.save(T_dir / "shape.npy", np.array(shape[::-1], dtype=np.int64))
+    row_dtype = np.int32 if shape[0] <= np.iinfo(np.int32).max else np.int64
+    T_data = np.lib.format.open_memmap(T_dir / "data.npy", mode="w+", dtype=data.dtype, shape=data.shape)
+    T_indices = np.lib.format.open_memmap(T_dir / "indices.npy", mode="w+", dtype=row_dtype, shape=data.shape)
+    if positions:
+        T_positions = np.lib.format.open_memmap(T_dir / "positions.npy", mode="w+", dtype=np.int64, shape=data.shape)
+
+    # i.e., the next free position of each col
+    cursor = T_indptr[:-1].copy()
+    for r0, r1 in blocks:
+        lo, hi = indptr[r0], indptr[r1]
+        cols = np.asarray(indices[lo:hi])
+        order = np.argsort(cols, kind="stable")  # i.e., rows in order, within each col
+        counts = np.bincount(cols, minlength=shape[1])
+        block_starts = np.cumsum(counts) - counts
+        sorted_cols = cols[order]
+        at = cursor[sorted_cols] + np.arange(hi - lo) - block_starts[sorted_cols]
+
+        rows = np.repeat(np.arange(r0, r1, dtype=row_dtype), np.diff(indptr[r0 : r1 + 1]))
+        T_indices[at] = rows[order]
+        T_data[at] = data[lo:hi][order]
+        if positions:
+            T_positions[at] = lo + order
+        cursor += counts
+
+    T_data.flush()
+    T_indices.flush()
+    if positions:
+        T_positions.flush()
+    return T_dir
+
+
+def get_col_sums(F_dir: pathlib.Path, blocks: list[tuple]) -> np.ndarray:
+    """Return the column sums of F, streamed block by block."""
+    data, indices, indptr, shape = open_csr(F_dir)
+    col_sums = np.zeros(shape[1])
+    for r0, r1 in blocks:
+        lo, hi = indptr[r0], indptr[r1]
+        col_sums += np.bincount(indices[lo:hi], weights=data[lo:hi], minlength=shape[1])
+    return col_sums
+
+
+def get_llr_blocked(
+    F_dir: pathlib.Path,
+    L_dir: pathlib.Path,
+    *,
+    block_mb: float = 512,
+    n_workers: int = 1,
+) -> pathlib.Path:
+    """Compute L wrt., the CSR dir F_dir, into the CSR dir L_dir, block by block, in
+    n_workers processes, each owning a contiguous range of blocks. Return L_dir."""
+    data, indices, indptr, shape = open_csr(F_dir)
+    blocks = get_blocks(indptr, get_block_nnz(block_mb))
+
+    col_sums = get_col_sums(F_dir, blocks)
+    n = col_sums.sum()
+
+    # L shares the indices and indptr of F
+    L_dir.mkdir(parents=True, exist_ok=True)
+    for name in ["indices.npy", "indptr.npy", "shape.npy"]:
+        shutil.copyfile(F_dir / name, L_dir / name)
+    np.lib.format.open_memmap(L_dir / "data.npy", mode="w+", dtype=np.float64, shape=data.shape)
+
+    if n_workers == 1:
+        compute_blocks(F_dir, L_dir, col_sums, n, tqdm(blocks))
+    else:
+        ranges = [list(blocks_) for blocks_ in np.array_split(np.array(blocks), n_workers)]
+        with Pool(n_workers) as pool:
+            pool.starmap(
+                compute_blocks,
+                [(F_dir, L_dir, col_sums, n, blocks_) for blocks_ in ranges if len(blocks_) > 0],
+            )
+    return L_dir
+
+
+def compute_blocks(
+    F_dir: pathlib.Path, L_dir: pathlib.Path, col_sums: np.ndarray, n: float, blocks: typing.Iterable
+):
+    """Write the llr of each nonzero, in the given blocks of rows, into L_dir."""
+    data, indices, indptr, _ = open_csr(F_dir)
+    L_data = np.load(L_dir / "data.npy", mmap_mode="r+")
+
+    for r0, r1 in blocks:
+        lo, hi = indptr[r0], indptr[r1]
+        study = np.asarray(data[lo:hi], dtype=float)
+        rows = np.repeat(np.arange(r1 - r0), np.diff(indptr[r0 : r1 + 1]))
+        row_sums = np.bincount(rows, weights=study, minlength=r1 - r0)
+        L_data[lo:hi] = get_llr_values(study, row_sums[rows], col_sums[indices[lo:hi]], n)
+
+    L_data.flush()
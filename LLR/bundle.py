@@ -0,0 +1,268 @@
+""" a memory-mapped, versioned bundle of the llr outputs, for fast (shared) loading
+
+Converts each switched-on config's output_dir/<role>/ (i.e., noun2i.json, feature2i.json,
+F and L, as .npz files or CSR dirs) into output_dir/bundle/, of uncompressed .npy files:
+    bundle.json  {"format": "llr_bundle", "version": 2, "roles": {role: {...}}}
+    <role>.nouns.offsets.npy, <role>.nouns.data.npy  i.e., the nouns, in noun2i order, as
+        utf-8 bytes, where noun i is data[offsets[i]:offsets[i + 1]]
+    <role>.nouns.order.npy  i.e., the noun indices, by sorted noun, for lookups
+    <role>.features.offsets.npy, <role>.features.data.npy, <role>.features.order.npy
+        i.e., as per nouns, in feature2i order
+    <role>.indptr.npy, <role>.indices.npy  i.e., int32 (else int64, if nnz > 2**31 - 1)
+    <role>.F.npy  i.e., int32 (else int64) counts
+    <role>.L.npy  i.e., float64, float32, or uint16 or uint8 codes (see quantize)
+
+Rows and cols are as per noun2i and feature2i, i.e., noun i is row i, as in the top-k
+(see topk.py) and affinity (see affinity.py) outputs, and a noun (or feature) is looked up
+by binary search over its order. L shares the sparsity (indptr and indices) of F, i.e., incl., any llr of exactly 0.
+Loading (see load_bundle) memory-maps each file read-only, s.t., it takes milliseconds,
+and the pages are shared between processes (e.g., notebook kernels) on the same host.
+
+run:
+    python3 bundle.py [--dtype float32]
+
+E.g.,
+    bundle = load_bundle(output_dir / "bundle")
+    i = bundle["adj"].nouns.index("man")
+    row = bundle["adj"].L[i]
+"""
+
+import argparse
+import json
+import pathlib
+import shutil
+import sys
+import typing
+
+import numpy as np
+from scipy.sparse import csr_matrix, load_npz
+
+import llr
+
+FORMAT = "llr_bundle"
+VERSION = 2
+L_DTYPES = ["float64", "float32", "uint16", "uint8"]
+
+
+def main(args):
+
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--dtype", choices=L_DTYPES, default="float32", help="dtype of L")
+    args = parser.parse_args(args)
+
+    # load configs
+    with open("configs.json", "r", encoding="utf-8") as f:
+        configs = json.load(f)
+
+    for config in configs:
+        if config["switch"]:
+            output_dir = pathlib.Path(config["output_dir"]).expanduser().resolve()
+            roles = {role: load_role(output_dir / role) for role in llr.ROLES}
+            write_bundle(output_dir / "bundle", roles, L_dtype=args.dtype)
+            print(f"{config['name']}: bundled {output_dir / 'bundle'}")
+
+
+def load_role(save_dir: pathlib.Path) -> tuple:
+    """Return (noun2i, feature2j, F, L) as saved by llr.save_role to save_dir."""
+    with open(save_dir / "noun2i.json", "r", encoding="utf-8") as f:
+        noun2i = json.load(f)
+    with open(save_dir / "feature2i.json", "r", encoding="utf-8") as f:
+        feature2j = json.load(f)
+
+    if (save_dir / "freq_profiles.npz").exists():
+        F = load_npz(save_dir / "freq_profiles.npz")
+        L = load_npz(save_dir / "llr_profiles.npz")
+    else:
+        import blocked
+
+        F = blocked.load_csr(save_dir / "freq_profiles")
+        L = blocked.load_csr(save_dir / "llr_profiles")
+    return noun2i, feature2j, F, L
+
+
+def write_bundle(bundle_dir: pathlib.Path, roles: dict[str, tuple], *, L_dtype: str = "float32"):
+    """Write {role: (noun2i, feature2j, F, L)} as a bundle at bundle_dir (replacing any)."""
+    tmp_dir = bundle_dir.with_name(bundle_dir.name + ".tmp")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+
+    manifest = {"format": FORMAT, "version": VERSION, "roles": {}}
+    for role, (noun2i, feature2j, F, L) in roles.items():
+        # i.e., by index, as per the rows and cols of F and L
+        nouns = sorted(noun2i, key=noun2i.get)
+        features = sorted(feature2j, key=feature2j.get)
+
+        F = csr_matrix(F)
+        F.sum_duplicates()
+        L = csr_matrix(L)
+        L.sum_duplicates()
+        L_data = get_aligned(F, L)
+
+        index_dtype = np.int32 if F.nnz <= np.iinfo(np.int32).max else np.int64
+        count_dtype = np.int32 if F.nnz == 0 or F.data.max() <= np.iinfo(np.int32).max else np.int64
+        L_data, quantization = quantize(L_data, L_dtype)
+
+        save_strings(tmp_dir, f"{role}.nouns", nouns)
+        save_strings(tmp_dir, f"{role}.features", features)
+        np.save(tmp_dir / f"{role}.indptr.npy", F.indptr.astype(index_dtype))
+        np.save(tmp_dir / f"{role}.indices.npy", F.indices.astype(index_dtype))
+        np.save(tmp_dir / f"{role}.F.npy", F.data.astype(count_dtype))
+        np.save(tmp_dir / f"{role}.L.npy", L_data)
+        manifest["roles"][role] = {
+            "shape": list(F.shape),
+            "nnz": int(F.nnz),
+            "L_dtype": L_dtype,
+            "L_quantization": quantization,
+        }
+
+    with open(tmp_dir / "bundle.json", "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+
+    shutil.rmtree(bundle_dir, ignore_errors=True)
+    tmp_dir.rename(bundle_dir)
+
+
+def get_aligned(F: csr_matrix, L: csr_matrix) -> np.ndarray:
+    """Return the values of L at each nonzero of F (in order), i.e., 0 where L holds none.
+
+    Note: assumes the sparsity of L is within that of F, as per llr.get_llr
+    """
+    F.sort_indices()
+    L.sort_indices()
+    F_keys = np.repeat(np.arange(F.shape[0], dtype=np.int64), np.diff(F.indptr)) * F.shape[1] + F.indices
+    L_keys = np.repeat(np.arange(L.shape[0], dtype=np.int64), np.diff(L.indptr)) * L.shape[1] + L.indices
+    aligned = np.zeros(F.nnz)
+    aligned[np.searchsorted(F_keys, L_keys)] = L.data
+    return aligned
+
+
+def quantize(data: np.ndarray, dtype: str) -> tuple[np.ndarray, typing.Union[dict, None]]:
+    """Return (data as dtype, quantization), where quantization is None for float dtypes,
+    else {"offset", "scale"}, s.t., a value is offset + code * scale.
+
+    Note: values are quantized linearly over their finite range, onto codes 0 to max - 1 of
+    the dtype, where the max code is nan
+    """
+    if dtype.startswith("float"):
+        return data.astype(dtype), None
+
+    nan_code = np.iinfo(dtype).max
+    finite = np.isfinite(data)
+    lo = float(data[finite].min()) if finite.any() else 0.0
+    hi = float(data[finite].max()) if finite.any() else 0.0
+    scale = (hi - lo) / (nan_code - 1) if hi > lo else 1.0
+
+    codes = np.full(len(data), nan_code, dtype=dtype)
+    codes[finite] = np.rint((data[finite] - lo) / scale).astype(dtype)
+    return codes, {"offset": lo, "scale": scale}
+
+
+def dequantize(codes: np.ndarray, quantization: typing.Union[dict, None]) -> np.ndarray:
+    """Return the values of codes, see quantize."""
+    if quantization is None:
+        return codes
+    values = quantization["offset"] + codes * np.float32(quantization["scale"])
+    values[codes == np.iinfo(codes.dtype).max] = np.nan
+    return values
+
+
+def save_strings(bundle_dir: pathlib.Path, name: str, strings: list[str]):
+    """Save strings (in order) as utf-8 bytes with offsets, and their order, i.e., the
+    indices of strings by sorted string."""
+    encoded = [string.encode("utf-8") for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    np.save(bundle_dir / f"{name}.offsets.npy", offsets)
+    np.save(bundle_dir / f"{name}.data.npy", np.frombuffer(b"".join(encoded), dtype=np.uint8))
+    order = sorted(range(len(strings)), key=strings.__getitem__)
+    np.save(bundle_dir / f"{name}.order.npy", np.array(order, dtype=np.int64))
+
+
+class StringTable:
+    def __init__(self, offsets: np.ndarray, data: np.ndarray, order: np.ndarray):
+        """A table of strings, as utf-8 bytes, i.e., string i is
+        data[offsets[i]:offsets[i + 1]], looked up by binary search over order (i.e., the
+        indices by sorted string)."""
+        self.offsets = offsets
+        self.data = data
+        self.order = order
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self.data[self.offsets[i] : self.offsets[i + 1]].tobytes().decode("utf-8")
+
+    def __iter__(self) -> typing.Iterator[str]:
+        return (self[i] for i in range(len(self)))
+
+    def __contains__(self, string: str) -> bool:
+        return self.find(string) is not None
+
+    def index(self, string: str) -> int:
+        """Return the index of string, else raise ValueError."""
+        i = self.find(string)
+        if i is None:
+            raise ValueError(f"{string!r} is not in the table")
+        return i
+
+    def find(self, string: str) -> typing.Union[int, None]:
+        """Return the index of string, else None."""
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self[int(self.order[mid])] < string:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self) and self[int(self.order[lo])] == string:
+            return int(self.order[lo])
+        return None
+
+
+class RoleBundle:
+    def __init__(self, bundle_dir: pathlib.Path, role: str, meta: dict):
+        """The memory-mapped vocabularies, F and L of a role."""
+
+        def load(name: str) -> np.ndarray:
+            return np.load(bundle_dir / f"{role}.{name}.npy", mmap_mode="r")
+
+        self.meta = meta
+        self.shape = tuple(meta["shape"])
+        self.nouns = StringTable(load("nouns.offsets"), load("nouns.data"), load("nouns.order"))
+        self.features = StringTable(load("features.offsets"), load("features.data"), load("features.order"))
+        self.indptr = load("indptr")
+        self.indices = load("indices")
+        self.F_data = load("F")
+        self.L_data = load("L")  # i.e., as stored, see quantize
+
+    @property
+    def F(self) -> csr_matrix:
+        return csr_matrix((self.F_data, self.indices, self.indptr), shape=self.shape, copy=False)
+
+    @property
+    def L(self) -> csr_matrix:
+        """Return L, where quantized L is dequantized (i.e., into memory) as float32."""
+        data = dequantize(self.L_data, self.meta["L_quantization"])
+        return csr_matrix((data, self.indices, self.indptr), shape=self.shape, copy=False)
+
+
+def load_bundle(bundle_dir: pathlib.Path) -> dict[str, RoleBundle]:
+    """Return {role: RoleBundle} wrt., the bundle at bundle_dir, else raise ValueError
+    where not a bundle of this version."""
+    bundle_dir = pathlib.Path(bundle_dir).expanduser().resolve()
+    with open(bundle_dir / "bundle.json", "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("format") != FORMAT or manifest.get("version") != VERSION:
+        raise ValueError(f"{bundle_dir}: not a {FORMAT} of version {VERSION}")
+    return {role: RoleBundle(bundle_dir, role, meta) for role, meta in manifest["roles"].items()}
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
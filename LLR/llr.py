@@ -2,17 +2,20 @@
 """
 
 import json
-import operator
 import pathlib
-import re
 import typing
-from collections import Counter, defaultdict
-from itertools import cycle, tee
 
 import numpy as np
-from scipy.sparse import csr_matrix, lil_matrix, save_npz
+import orjson
+from scipy.sparse import coo_matrix, csr_matrix, lil_matrix, save_npz
 from tqdm import tqdm
-from tqdm.contrib.concurrent import process_map
+
+import topk
+
+ROLES = ["adj", "agent", "patient"]
+
+# (noun, feature) pairs held per role, before summing duplicates, see PairCounts
+CHUNK_PAIRS = 2**24
 
 def main():
 
@@ -31,89 +34,257 @@ def main():
         # ...
         if switch:
 
-            fps = list(input_dir.glob('*.json'))
-
-            tuples = gen_tuples(fps)
-            tuples_1, tuples_2, tuples_3, tuples_4, tuples_5, tuples_6 = tee(tuples, 6)
-            # yields (noun, feature, role, pattern, filename) tuples
-
-            # build frequency matrices and llr matrices
-            for tuples_x, tuples_y, role in [
-                (tuples_1, tuples_2, "adj"),
-                (tuples_3, tuples_4, "agent"),
-                (tuples_5, tuples_6, "patient"),
-            ]:
-                # i.e., tuples_x generator is exhausted building noun2i & feature2i wrt., specified role
-                # i.e., tuples_y generator is exhausted building noun--feature co-occurrence frequency matrix, indexed by aforementioned noun2i and feature2i indices
-
-                print(f"\tbuild indices wrt., role")
-                nouns = set([])
-                features = set([])
-                for tup in tuples_x:
-                    # only collect nouns where feature present
-                    if tup[2] == role:
-                        nouns.add(tup[0])
-                        features.add(tup[1])
-                noun2i = {x: i for i, x in enumerate(nouns)}
-                feature2j = {x: j for j, x in enumerate(features)}
-                print(f"role:{role}, {len(nouns)} nouns, {len(features)} features")
-
-                print(f"\tbuild frequency matrix wrt., role")
-                F = lil_matrix((len(nouns), len(features)), dtype=int)
-                for tup in tuples_y:
-                    if tup[2] == role:
-                        i = noun2i[tup[0]]
-                        j = feature2j[tup[1]]
-                        F[i, j] += 1
-                F = csr_matrix(F)
+            # Note: ignoring the outputs of near-duplicate books, as per Tuples/dedup.py (if run)
+            fps = get_fps(input_dir, dropped=get_dropped(config))
+
+            if config.get("shards_dir"):
+                # i.e., per-book count shards, built and merged in n_workers processes
+                import shards
+
+                shards_dir = pathlib.Path(config["shards_dir"]).expanduser().resolve()
+                n_workers = int(config.get("n_workers", 1))
+                print(f"\tshard {len(fps)} outputs")
+                shard_fps = shards.build_shards(fps, shards_dir, n_workers=n_workers)
+                ingested = shards.merge_shards(shard_fps, n_workers=n_workers)
+            else:
+                # read each output once, building the vocabularies and pair counts of all roles
+                print(f"\tingest {len(fps)} outputs")
+                ingested = ingest(fps)
+
+            # build llr matrices
+            for role, (noun2i, feature2j, F) in ingested.items():
+                print(f"role:{role}, {len(noun2i)} nouns, {len(feature2j)} features")
                 # thus all features have at least one coincident noun, and all nouns have at least one coincident features
                 # that is, all rows and column have at least one entry
 
-                print(f"\tbuild a LLR scores, for a total of {len(nouns)} nouns")
-                L = lil_matrix(F.shape, dtype=float)
-                llr_profiles = process_map(
-                    get_llr_profile_star, zip(range(F.shape[0]), cycle([F])), chunksize=1000
-                )  # a list of rows of L
-                print(f"\t\tassemble L by calculated rows")
-                for row_i, llr_profile in tqdm(enumerate(llr_profiles)):
-                    L[row_i, :] = llr_profile
-                print(f"\t\t convert lil_matrix to csr_matrix")
-                L = csr_matrix(L)
+                save_role(output_dir / role, noun2i, feature2j, F, config)
 
-                # save 
-                print("save noun2i, feature2i, F, L")
-                save_dir = output_dir / role
-                save_dir.mkdir(parents=True, exist_ok=True)
 
-                with open(save_dir / "noun2i.json", "w", encoding="utf-8") as f:
-                    json.dump(noun2i, f)
+def save_role(
+    save_dir: pathlib.Path,
+    noun2i: dict,
+    feature2j: dict,
+    F: csr_matrix,
+    config: dict,
+    *,
+    row_sums: typing.Union[np.ndarray, None] = None,
+    col_sums: typing.Union[np.ndarray, None] = None,
+):
+    """Save noun2i, feature2i, F and L (wrt., F) to save_dir, i.e., as .npz files, else as
+    memory-mapped CSR dirs if config["llr_block_mb"] (see blocked.py), and the top-k
+    indexes of L (see topk.py).
 
-                with open(save_dir / "feature2i.json", "w", encoding="utf-8") as f:
-                    json.dump(feature2j, f)
+    Note: the row and col sums of F, if known, are passed to get_llr
+    """
+    print("save noun2i, feature2i")
+    save_dir.mkdir(parents=True, exist_ok=True)
+
+    with open(save_dir / "noun2i.json", "w", encoding="utf-8") as f:
+        json.dump(noun2i, f)
+
+    with open(save_dir / "feature2i.json", "w", encoding="utf-8") as f:
+        json.dump(feature2j, f)
+
+    print(f"\tbuild a LLR scores, for a total of {len(noun2i)} nouns")
+    if config.get("llr_block_mb"):
+        # i.e., out-of-core: F and L saved as memory-mapped CSR dirs
+        import blocked
+
+        blocked.save_csr(save_dir / "freq_profiles", F)
+        del F
+        blocked.get_llr_blocked(
+            save_dir / "freq_profiles",
+            save_dir / "llr_profiles",
+            block_mb=float(config["llr_block_mb"]),
+            n_workers=int(config.get("n_workers", 1)),
+        )
+        print("save top-k indexes")
+        topk.save_topk_blocked(
+            save_dir,
+            save_dir / "llr_profiles",
+            k=config.get("top_k"),
+            block_nnz=blocked.get_block_nnz(float(config["llr_block_mb"])),
+        )
+    else:
+        L = get_llr(F, row_sums=row_sums, col_sums=col_sums)
+        print("save F, L")
+        save_npz(save_dir / "freq_profiles.npz", F)
+        save_npz(save_dir / "llr_profiles.npz", L)
+
+        print("save top-k indexes")
+        topk.save_topk(save_dir, L, k=config.get("top_k"))
+
+
+def ingest(fps, *, chunk_pairs: int = CHUNK_PAIRS) -> dict[str, tuple]:
+    """Return {role: (noun2i, feature2j, F)} wrt., the tuples of all outputs at fps,
+    reading each output once, where F::csr_matrix holds the (noun, feature) counts.
+
+    Note: per output, nouns and features are mapped to their indices via its (small)
+    string table, i.e., vectorized over tuples
+    Note: memory is bounded by the number of distinct (noun, feature) pairs, see PairCounts
+    """
+    ingested = {role: ({}, {}, PairCounts(chunk_pairs=chunk_pairs)) for role in ROLES}
+    for fp in tqdm(fps):
+        strings, nouns, features, roles = read_codes(fp)
+        for role, (noun2i, feature2j, counts) in ingested.items():
+            if role not in strings:
+                continue
+            mask = roles == strings.index(role)
+            rows = get_indices(nouns[mask], strings, noun2i)
+            cols = get_indices(features[mask], strings, feature2j)
+            counts.add(rows, cols, shape=(len(noun2i), len(feature2j)))
+
+    return {
+        role: (noun2i, feature2j, counts.to_csr(shape=(len(noun2i), len(feature2j))))
+        for role, (noun2i, feature2j, counts) in ingested.items()
+    }
+
+
+def get_indices(codes: np.ndarray, strings: list[str], string2i: dict) -> np.ndarray:
+    """Return the (int32) indices wrt., string2i of strings[code] for each code, adding
+    unseen strings to string2i (in order of code)."""
+    lut = np.full(len(strings), -1, dtype=np.int32)
+    for code in np.unique(codes):
+        lut[code] = string2i.setdefault(strings[code], len(string2i))
+    return lut[codes]
+
+
+class PairCounts:
+    def __init__(self, *, chunk_pairs: int = CHUNK_PAIRS):
+        """Accumulate (i, j) pairs in int32 chunks, summed (as a COO matrix, summing
+        duplicates) into a CSR matrix of counts whenever chunk_pairs pairs are pending."""
+        self.chunk_pairs = chunk_pairs
+        self.rows: list[np.ndarray] = []
+        self.cols: list[np.ndarray] = []
+        self.n_pending = 0
+        self.F = None
+
+    def add(self, rows: np.ndarray, cols: np.ndarray, *, shape: tuple):
+        self.rows.append(rows.astype(np.int32, copy=False))
+        self.cols.append(cols.astype(np.int32, copy=False))
+        self.n_pending += len(rows)
+        if self.n_pending >= self.chunk_pairs:
+            self.compact(shape)
+
+    def compact(self, shape: tuple):
+        """Sum the pending pairs into the counts, where shape is the current (nouns, features)."""
+        rows = np.concatenate(self.rows) if self.rows else np.zeros(0, dtype=np.int32)
+        cols = np.concatenate(self.cols) if self.cols else np.zeros(0, dtype=np.int32)
+        pending = coo_matrix(
+            (np.ones(len(rows), dtype=np.int64), (rows, cols)), shape=shape
+        ).tocsr()  # i.e., summing duplicates
+        if self.F is None:
+            self.F = pending
+        else:
+            self.F.resize(shape)  # i.e., the vocabularies only grow
+            self.F = self.F + pending
+        self.rows, self.cols, self.n_pending = [], [], 0
+
+    def to_csr(self, *, shape: tuple) -> csr_matrix:
+        self.compact(shape)
+        self.F.sort_indices()
+        return self.F
+
+
+def read_codes(fp: pathlib.Path) -> tuple:
+    """Return (strings, nouns, features, roles) wrt., the output at fp, where nouns,
+    features and roles are int32 arrays of indices into the list of strings."""
+
+    if fp.suffix == ".jsonl":
+        strings = []
+        cols = {"noun": [], "feature": [], "role": []}
+        for row_group in read_row_groups(fp):
+            strings += row_group["strings"]
+            for col in cols:
+                cols[col] += row_group[col]
+    else:
+        string2code = {}
+        cols = {"noun": [], "feature": [], "role": []}
+        for noun, feature, role, *_ in gen_tuples_legacy(fp):
+            for col, string in [("noun", noun), ("feature", feature), ("role", role)]:
+                cols[col].append(string2code.setdefault(string, len(string2code)))
+        strings = list(string2code)
+
+    return (
+        strings,
+        np.array(cols["noun"], dtype=np.int32),
+        np.array(cols["feature"], dtype=np.int32),
+        np.array(cols["role"], dtype=np.int32),
+    )
 
-                save_npz(save_dir / "freq_profiles.npz", F)
-                save_npz(save_dir / "llr_profiles.npz", L)
 
+def get_llr(
+    F: csr_matrix,
+    *,
+    row_sums: typing.Union[np.ndarray, None] = None,
+    col_sums: typing.Union[np.ndarray, None] = None,
+) -> csr_matrix:
+    """Return the llr matrix L wrt., F, i.e., for each noun (row) as the study corpus and
+    all other nouns as the ref corpus, as per get_llr_profile, computed in one vectorized
+    sweep over the nonzeros of F.
 
-def log_binom(k: np.ndarray, n: float, p: np.ndarray) -> np.ndarray:
+    Note: L has the sparsity of F, i.e., L[i, j] = 0 where F[i, j] = 0 (bar any llr of
+    exactly 0, which are not stored, as before)
+    Note: the row and col sums of F (i.e., the marginals) are computed, unless given
+    """
+    F = csr_matrix(F)
+    F.sum_duplicates()
+    if row_sums is None:
+        row_sums = np.asarray(F.sum(axis=1)).ravel()
+    if col_sums is None:
+        col_sums = np.asarray(F.sum(axis=0)).ravel()
+    row_sums = np.asarray(row_sums, dtype=float)
+    col_sums = np.asarray(col_sums, dtype=float)
+    n = row_sums.sum()
+
+    # per nonzero (i, j)
+    rows = np.repeat(np.arange(F.shape[0]), np.diff(F.indptr))
+    data = get_llr_values(F.data.astype(float), row_sums[rows], col_sums[F.indices], n)
+
+    L = csr_matrix((data, F.indices.copy(), F.indptr.copy()), shape=F.shape)
+    L.eliminate_zeros()
+    return L
+
+
+def get_llr_values(study: np.ndarray, n1: np.ndarray, col_sum: np.ndarray, n: float) -> np.ndarray:
+    """Return the llr of each nonzero (i, j) of F, given its count F[i, j] (i.e., study),
+    the row sum of i (i.e., n1), the col sum of j, and the sum of F (i.e., n)."""
+    ref = col_sum - study  # i.e., the count of feature j wrt., all nouns but i
+    n2 = n - n1
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        study_mle = study / n1
+        ref_mle = ref / n2  # i.e., nan where the noun is the only noun (n2 = 0), as before
+        p = col_sum / n
+
+        return 2 * (
+            # alt
+            log_binom(study, n1, study_mle)
+            + log_binom(ref, n2, ref_mle)
+            # null
+            - log_binom(study, n1, p)
+            - log_binom(ref, n2, p)
+        )
+
+
+def log_binom(k: np.ndarray, n: typing.Union[float, np.ndarray], p: np.ndarray) -> np.ndarray:
 
     result = np.zeros(len(k))
+    n = np.broadcast_to(n, np.shape(k))  # i.e., a float, or per k
     # Note: @p==1, log(p) = 0: hence handled implicity
 
     # where p > 0 and p < 1
     mask = (p > 0) & (p < 1)
-    result[mask] = k[mask] * np.log(p[mask]) + (n - k[mask]) * np.log(1 - p[mask])
+    result[mask] = k[mask] * np.log(p[mask]) + (n[mask] - k[mask]) * np.log(1 - p[mask])
 
     return result
 
 
-def get_llr_profile_star(t):
-    return get_llr_profile(*t)
-
-
 def get_llr_profile(row_i, F) -> np.ndarray:
     """Build a llr profile for row_i
     where row_i is the study corpus and row_i' is the ref corpus.
+
+    Note: i.e., the per-row reference for get_llr
     """
 
     # get the study corpus and ref_corpus
@@ -154,18 +325,89 @@ def get_llr_profile(row_i, F) -> np.ndarray:
     return lil_matrix(llr_profile)
 
 
+def get_fps(input_dir: pathlib.Path, *, dropped: typing.AbstractSet[str] = frozenset()) -> list[pathlib.Path]:
+    """Return the tuples outputs in input_dir, i.e., <book>.jsonl, else legacy <book>.json,
+    except those of the dropped book stems."""
+    fps = sorted(fp for fp in input_dir.glob("*.jsonl") if fp.stem not in dropped)
+    stems = set(fp.stem for fp in fps)
+    fps += sorted(fp for fp in input_dir.glob("*.json") if fp.stem not in stems | dropped)
+    return fps
+
+
+def get_dropped(config: dict) -> set[str]:
+    """Return the set of book stems dropped as near-duplicates, as listed by
+    config["dedup_report"] (see Tuples/dedup.py), else an empty set."""
+    if config.get("dedup_report"):
+        report_fp = pathlib.Path(config["dedup_report"]).expanduser().resolve()
+        if report_fp.exists():
+            with open(report_fp, "r", encoding="utf-8") as f:
+                return set(json.load(f)["dropped"])
+    return set()
+
+
 def gen_tuples(fps) -> typing.Generator:
     """Return a generator of e.g., ['man', 'medium-sized', 'adj', 'A_h', filename] objects"""
 
     for fp in fps:
+        if fp.suffix == ".jsonl":
+            yield from gen_tuples_columnar(fp)
+        else:
+            yield from gen_tuples_legacy(fp)
+
 
-        with open(fp, "r", encoding="utf-8") as f:
-            doc = json.load(f)
+def gen_tuples_columnar(fp: pathlib.Path) -> typing.Generator:
+    """Return a generator of tuples wrt., a columnar output (see Tuples/tuple_output.py),
+    i.e., reading the noun, feature, role and pattern cols of each row group only."""
 
-        for i, tuples in enumerate(doc, start=1):
-            if i % 2 == 0:
-                for tup in tuples:
-                    yield list(tup) + [fp.name]
+    strings = []
+    for row_group in read_row_groups(fp):
+        strings += row_group["strings"]
+        for noun, feature, role, pattern in zip(
+            row_group["noun"], row_group["feature"], row_group["role"], row_group["pattern"]
+        ):
+            yield [strings[noun], strings[feature], strings[role], strings[pattern], fp.name]
+
+
+def read_row_groups(fp: pathlib.Path) -> list[dict]:
+    """Return the row groups of the columnar output at fp, i.e., excl. header and footer.
+
+    Raises ValueError if fp is not a complete output, e.g., truncated, as per
+    Tuples/tuple_output.read_encoded (see Tuples/checkpoints.py, to remove such outputs)
+    """
+    with open(fp, "rb") as f:
+        lines = f.read().splitlines()
+    if len(lines) < 2:
+        raise ValueError(f"{fp}: not a tuples output")
+
+    try:
+        header = orjson.loads(lines[0])
+        footer = orjson.loads(lines[-1])
+        row_groups = [orjson.loads(line) for line in lines[1:-1]]
+    except orjson.JSONDecodeError as e:
+        raise ValueError(f"{fp}: not a complete tuples output ({e})") from e
+    if header.get("format") != "tuples" or "n_row_groups" not in footer:
+        raise ValueError(f"{fp}: not a complete tuples output")
+
+    if (
+        len(row_groups) != footer["n_row_groups"]
+        or sum(row_group["n_rows"] for row_group in row_groups) != footer["n_rows"]
+        or any(len(row_group["noun"]) != row_group["n_rows"] for row_group in row_groups)
+    ):
+        raise ValueError(f"{fp}: not a complete tuples output")
+    return row_groups
+
+
+def gen_tuples_legacy(fp: pathlib.Path) -> typing.Generator:
+    """Return a generator of tuples wrt., a legacy output, i.e., a list of alternating
+    texts (or spans) and tuple lists."""
+
+    with open(fp, "r", encoding="utf-8") as f:
+        doc = json.load(f)
+
+    for i, tuples in enumerate(doc, start=1):
+        if i % 2 == 0:
+            for tup in tuples:
+                yield list(tup) + [fp.name]
 
 
 if __name__ == "__main__":
@@ -0,0 +1,186 @@
+""" per-book sparse count shards, merged by a parallel tree reduction
+
+Each output <book>.jsonl (or legacy .json) is turned into a shard <shards_dir>/<book>.npz
+holding, per role, its local noun and feature vocabularies and its (noun, feature) counts
+wrt., them (as COO arrays), in n_workers processes. Shards are kept, and rebuilt only
+where their output has changed (by size and mtime), s.t., F wrt., any subset of books
+(e.g., a slice of the corpus) is a merge of existing shards.
+
+Shards are merged pairwise, level by level, in n_workers processes, i.e., a tree of depth
+log2(books). Vocabularies are merged left then right, s.t., F (incl., the indices of
+noun2i and feature2j) is as per llr.ingest wrt., the same books in the same order.
+
+E.g., enable via "shards_dir" (and "n_workers") in configs.json, or
+    noun2i, feature2j, F = shards.get_F(shards_dir, stems, n_workers=4)["adj"]
+"""
+
+import pathlib
+import typing
+from multiprocessing import Pool
+
+import numpy as np
+from scipy.sparse import coo_matrix, csr_matrix
+from tqdm import tqdm
+
+import llr
+
+
+def build_shards(fps: list[pathlib.Path], shards_dir: pathlib.Path, *, n_workers: int = 1) -> list[pathlib.Path]:
+    """Return the shard fps wrt., the outputs at fps (in order), building any missing or
+    outdated shards in n_workers processes."""
+    shards_dir.mkdir(parents=True, exist_ok=True)
+    shard_fps = [get_shard_fp(shards_dir, fp) for fp in fps]
+    todo = [(fp, shard_fp) for fp, shard_fp in zip(fps, shard_fps) if not is_current(shard_fp, fp)]
+
+    if n_workers == 1:
+        for args in tqdm(todo):
+            build_shard(args)
+    else:
+        with Pool(n_workers) as pool:
+            for _ in tqdm(pool.imap_unordered(build_shard, todo), total=len(todo)):
+                pass
+    return shard_fps
+
+
+def get_shard_fp(shards_dir: pathlib.Path, fp: pathlib.Path) -> pathlib.Path:
+    return shards_dir / f"{fp.stem}.npz"
+
+
+def get_source(fp: pathlib.Path) -> np.ndarray:
+    """Return the (size, mtime_ns) of the output at fp, against which its shard is current."""
+    stat = fp.stat()
+    return np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+
+def is_current(shard_fp: pathlib.Path, fp: pathlib.Path) -> bool:
+    if not shard_fp.exists():
+        return False
+    try:
+        with np.load(shard_fp) as shard:
+            return np.array_equal(shard["source"], get_source(fp))
+    except (OSError, ValueError, KeyError):  # e.g., partially written
+        return False
+
+
+def build_shard(args: tuple):
+    """Save the shard of the output at fp to shard_fp."""
+    fp, shard_fp = args
+    strings, nouns, features, roles = llr.read_codes(fp)
+
+    arrays = {"source": get_source(fp)}
+    for role in llr.ROLES:
+        noun2i, feature2j = {}, {}
+        if role in strings:
+            mask = roles == strings.index(role)
+            rows = llr.get_indices(nouns[mask], strings, noun2i)
+            cols = llr.get_indices(features[mask], strings, feature2j)
+        else:
+            rows = cols = np.zeros(0, dtype=np.int32)
+        arrays.update(get_arrays(role, (list(noun2i), list(feature2j), rows, cols, np.ones(len(rows), dtype=np.int64))))
+
+    # i.e., written whole, then renamed
+    tmp_fp = shard_fp.with_suffix(".tmp.npz")
+    np.savez(tmp_fp, **arrays)
+    tmp_fp.replace(shard_fp)
+
+
+def get_arrays(role: str, part: tuple) -> dict[str, np.ndarray]:
+    """Return the named arrays of a role's (nouns, features, rows, cols, counts), summing
+    duplicate (row, col) pairs."""
+    nouns, features, rows, cols, counts = part
+    M = coo_matrix((counts, (rows, cols)), shape=(len(nouns), len(features)))
+    M.sum_duplicates()
+    return {
+        f"{role}_nouns": np.array(nouns, dtype=str),
+        f"{role}_features": np.array(features, dtype=str),
+        f"{role}_rows": M.row.astype(np.int32),
+        f"{role}_cols": M.col.astype(np.int32),
+        f"{role}_counts": M.data.astype(np.int64),
+    }
+
+
+def load_shard(shard_fp: pathlib.Path) -> dict[str, tuple]:
+    """Return {role: (nouns, features, rows, cols, counts)} of the shard."""
+    with np.load(shard_fp) as shard:
+        return {
+            role: (
+                shard[f"{role}_nouns"].tolist(),
+                shard[f"{role}_features"].tolist(),
+                shard[f"{role}_rows"],
+                shard[f"{role}_cols"],
+                shard[f"{role}_counts"],
+            )
+            for role in llr.ROLES
+        }
+
+
+def merge_pair(pair: tuple) -> dict[str, tuple]:
+    """Return the merge of a pair of shards (each a shard fp, or a loaded/merged shard),
+    where the vocabularies of the right are appended to those of the left."""
+    left, right = [load_shard(x) if isinstance(x, pathlib.Path) else x for x in pair]
+
+    merged = {}
+    for role in llr.ROLES:
+        nouns, features, rows, cols, counts = left[role]
+        r_nouns, r_features, r_rows, r_cols, r_counts = right[role]
+
+        noun2i = {noun: i for i, noun in enumerate(nouns)}
+        feature2j = {feature: j for j, feature in enumerate(features)}
+        row_lut = np.array([noun2i.setdefault(noun, len(noun2i)) for noun in r_nouns], dtype=np.int32)
+        col_lut = np.array([feature2j.setdefault(f, len(feature2j)) for f in r_features], dtype=np.int32)
+
+        arrays = get_arrays(
+            role,
+            (
+                list(noun2i),
+                list(feature2j),
+                np.concatenate([rows, row_lut[r_rows]]),
+                np.concatenate([cols, col_lut[r_cols]]),
+                np.concatenate([counts, r_counts]),
+            ),
+        )
+        merged[role] = (
+            list(noun2i),
+            list(feature2j),
+            arrays[f"{role}_rows"],
+            arrays[f"{role}_cols"],
+            arrays[f"{role}_counts"],
+        )
+    return merged
+
+
+def merge_shards(shard_fps: list[pathlib.Path], *, n_workers: int = 1) -> dict[str, tuple]:
+    """Return {role: (noun2i, feature2j, F)} wrt., the shards at shard_fps, merged
+    pairwise, level by level, where each level is merged in n_workers processes."""
+    level: list[typing.Union[pathlib.Path, dict]] = list(shard_fps)
+    if len(level) == 0:
+        return {role: ({}, {}, csr_matrix((0, 0), dtype=np.int64)) for role in llr.ROLES}
+
+    pool = Pool(n_workers) if n_workers > 1 else None
+    try:
+        while len(level) > 1:
+            pairs = [(level[k], level[k + 1]) for k in range(0, len(level) - 1, 2)]
+            merged = pool.map(merge_pair, pairs) if pool else [merge_pair(pair) for pair in pairs]
+            level = merged + ([level[-1]] if len(level) % 2 else [])
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+
+    root = load_shard(level[0]) if isinstance(level[0], pathlib.Path) else level[0]
+    result = {}
+    for role, (nouns, features, rows, cols, counts) in root.items():
+        F = csr_matrix((counts, (rows, cols)), shape=(len(nouns), len(features)))
+        F.sort_indices()
+        result[role] = (
+            {noun: i for i, noun in enumerate(nouns)},
+            {feature: j for j, feature in enumerate(features)},
+            F,
+        )
+    return result
+
+
+def get_F(shards_dir: pathlib.Path, stems: list[str], *, n_workers: int = 1) -> dict[str, tuple]:
+    """Return {role: (noun2i, feature2j, F)} wrt., the (existing) shards of the given book
+    stems, e.g., a subset of the corpus."""
+    return merge_shards([shards_dir / f"{stem}.npz" for stem in stems], n_workers=n_workers)
@@ -0,0 +1,247 @@
+""" a persistent count store, for incremental llr updates as books are added or removed
+
+Per config, the store (config["store_dir"], else <output_dir>/store) holds, per role,
+append-only noun and feature vocabularies, the counts F and its row and col sums, plus,
+per ingested book, a fingerprint of its output and its (noun, feature) counts wrt., the
+vocabularies (i.e., its delta). Syncing the store with input_dir:
+    * subtracts the delta of each book whose output was removed or has changed
+    * adds the delta of each new (or changed) book, i.e., reads those outputs only
+    * updates F and its row and col sums, by the deltas
+    * saves noun2i.json, feature2i.json, F and L per role to output_dir, as per llr.py
+
+Note: vocabularies are append-only, s.t., indices are stable across updates, and new
+strings are indexed in order of book stem, s.t., the same sequence of syncs gives the same
+store. A noun (or feature) whose counts are all removed keeps its (all-zero) row (or col)
+Note: the total count of F changes with any book, hence so does the llr of every nonzero;
+L is recomputed in one vectorized sweep over the nonzeros of F (see llr.get_llr)
+Note: output_dir is saved before the store's state is replaced, s.t., an interrupted sync
+is redone in full by the next
+
+run:
+    python3 store.py
+"""
+
+import hashlib
+import json
+import pathlib
+import shutil
+import sys
+
+import numpy as np
+from scipy.sparse import coo_matrix, csr_matrix, load_npz, save_npz
+
+import llr
+
+
+def main(args):
+
+    # load configs
+    with open("configs.json", "r", encoding="utf-8") as f:
+        configs = json.load(f)
+
+    for config in configs:
+        if config["switch"]:
+            input_dir = pathlib.Path(config["input_dir"]).expanduser().resolve()
+            output_dir = pathlib.Path(config["output_dir"]).expanduser().resolve()
+            store_dir = pathlib.Path(config.get("store_dir", output_dir / "store")).expanduser().resolve()
+
+            store = CountStore(store_dir)
+            added, removed = store.sync(llr.get_fps(input_dir, dropped=llr.get_dropped(config)))
+            print(f"{config['name']}: {len(added)} books added, {len(removed)} removed")
+
+            if added or removed or not all((output_dir / role).exists() for role in llr.ROLES):
+                for role in llr.ROLES:
+                    noun2i, feature2j, F, row_sums, col_sums = store.get_role(role)
+                    print(f"role:{role}, {len(noun2i)} nouns, {len(feature2j)} features")
+                    llr.save_role(
+                        output_dir / role, noun2i, feature2j, F, config, row_sums=row_sums, col_sums=col_sums
+                    )
+            store.save()
+
+
+class CountStore:
+    def __init__(self, store_dir: pathlib.Path):
+        """Load the store at store_dir (else, an empty store).
+
+        Layout:
+            state/books.json  {stem: {"name", "size", "mtime_ns", "hash"}}
+            state/<role>/nouns.json, features.json  i.e., the vocabularies, as lists
+            state/<role>/F.npz, row_sums.npy, col_sums.npy
+            deltas/<stem>.<hash>.npz  i.e., per role, the rows, cols and counts of the book
+        """
+        self.store_dir = store_dir
+        self.state_dir = store_dir / "state"
+        self.deltas_dir = store_dir / "deltas"
+
+        # i.e., where interrupted between renames, see save
+        if not self.state_dir.exists() and (store_dir / "state.old").exists():
+            (store_dir / "state.old").rename(self.state_dir)
+
+        self.books: dict[str, dict] = {}
+        self.vocabs: dict[str, tuple[dict, dict]] = {role: ({}, {}) for role in llr.ROLES}
+        self.F: dict[str, csr_matrix] = {}
+        self.row_sums: dict[str, np.ndarray] = {}
+        self.col_sums: dict[str, np.ndarray] = {}
+
+        if self.state_dir.exists():
+            with open(self.state_dir / "books.json", "r", encoding="utf-8") as f:
+                self.books = json.load(f)
+            for role in llr.ROLES:
+                role_dir = self.state_dir / role
+                with open(role_dir / "nouns.json", "r", encoding="utf-8") as f:
+                    nouns = json.load(f)
+                with open(role_dir / "features.json", "r", encoding="utf-8") as f:
+                    features = json.load(f)
+                self.vocabs[role] = (
+                    {noun: i for i, noun in enumerate(nouns)},
+                    {feature: j for j, feature in enumerate(features)},
+                )
+                self.F[role] = load_npz(role_dir / "F.npz").tocsr()
+                self.row_sums[role] = np.load(role_dir / "row_sums.npy")
+                self.col_sums[role] = np.load(role_dir / "col_sums.npy")
+        else:
+            for role in llr.ROLES:
+                self.F[role] = csr_matrix((0, 0), dtype=np.int64)
+                self.row_sums[role] = np.zeros(0, dtype=np.int64)
+                self.col_sums[role] = np.zeros(0, dtype=np.int64)
+
+    def get_role(self, role: str) -> tuple:
+        """Return (noun2i, feature2j, F, row_sums, col_sums) of the role."""
+        noun2i, feature2j = self.vocabs[role]
+        return noun2i, feature2j, self.F[role], self.row_sums[role], self.col_sums[role]
+
+    def sync(self, fps: list[pathlib.Path]) -> tuple[list[str], list[str]]:
+        """Update the store wrt., the outputs at fps, i.e., the current books. Return
+        (added, removed) book stems, where a changed book is in both."""
+        stem2fp = {fp.stem: fp for fp in fps}
+
+        removed = sorted(stem for stem in self.books if stem not in stem2fp)
+        added = []
+        for stem, fp in sorted(stem2fp.items()):
+            fingerprint = self.get_fingerprint(fp, self.books.get(stem))
+            if stem not in self.books:
+                added.append((stem, fp, fingerprint))
+            elif fingerprint["hash"] != self.books[stem]["hash"]:
+                removed.append(stem)
+                added.append((stem, fp, fingerprint))
+            else:
+                self.books[stem] = fingerprint  # e.g., touched, but unchanged
+
+        for stem in removed:
+            self.remove_book(stem)
+        for stem, fp, fingerprint in added:
+            self.add_book(stem, fp, fingerprint)
+
+        return [stem for stem, *_ in added], removed
+
+    @staticmethod
+    def get_fingerprint(fp: pathlib.Path, previous: dict = None) -> dict:
+        """Return {"name", "size", "mtime_ns", "hash"} of the output at fp.
+
+        Note: the output is only hashed (i.e., read) where its size or mtime has changed
+        """
+        stat = fp.stat()
+        fingerprint = {"name": fp.name, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+        if previous and all(previous[key] == fingerprint[key] for key in ["name", "size", "mtime_ns"]):
+            fingerprint["hash"] = previous["hash"]
+        else:
+            with open(fp, "rb") as f:
+                fingerprint["hash"] = hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+        return fingerprint
+
+    def add_book(self, stem: str, fp: pathlib.Path, fingerprint: dict):
+        """Add the counts of the output at fp, extending the vocabularies, and save its delta."""
+        strings, nouns, features, roles = llr.read_codes(fp)
+
+        delta = {}
+        for role in llr.ROLES:
+            noun2i, feature2j = self.vocabs[role]
+            if role in strings:
+                mask = roles == strings.index(role)
+                rows = llr.get_indices(nouns[mask], strings, noun2i)
+                cols = llr.get_indices(features[mask], strings, feature2j)
+            else:
+                rows = cols = np.zeros(0, dtype=np.int32)
+            D = coo_matrix(
+                (np.ones(len(rows), dtype=np.int64), (rows, cols)), shape=(len(noun2i), len(feature2j))
+            )
+            D.sum_duplicates()
+            delta[f"{role}_rows"] = D.row.astype(np.int32)
+            delta[f"{role}_cols"] = D.col.astype(np.int32)
+            delta[f"{role}_counts"] = D.data
+            self.apply(role, D, sign=1)
+
+        self.deltas_dir.mkdir(parents=True, exist_ok=True)
+        np.savez(self.get_delta_fp(stem, fingerprint["hash"]), **delta)
+        self.books[stem] = fingerprint
+
+    def remove_book(self, stem: str):
+        """Subtract the (saved) counts of the book."""
+        with np.load(self.get_delta_fp(stem, self.books[stem]["hash"])) as delta:
+            for role in llr.ROLES:
+                noun2i, feature2j = self.vocabs[role]
+                D = coo_matrix(
+                    (delta[f"{role}_counts"], (delta[f"{role}_rows"], delta[f"{role}_cols"])),
+                    shape=(len(noun2i), len(feature2j)),
+                )
+                self.apply(role, D, sign=-1)
+        del self.books[stem]
+
+    def apply(self, role: str, D: coo_matrix, *, sign: int):
+        """Add (sign=1) or subtract (sign=-1) the counts D to F and its row and col sums,
+        where D is wrt., the current vocabularies."""
+        shape = D.shape
+        F = self.F[role]
+        F.resize(shape)  # i.e., the vocabularies only grow
+        F = F + sign * D.tocsr()
+        F.eliminate_zeros()
+        F.sort_indices()
+        self.F[role] = F
+
+        row_sums = np.zeros(shape[0], dtype=np.int64)
+        row_sums[: len(self.row_sums[role])] = self.row_sums[role]
+        col_sums = np.zeros(shape[1], dtype=np.int64)
+        col_sums[: len(self.col_sums[role])] = self.col_sums[role]
+        row_sums += sign * np.bincount(D.row, weights=D.data, minlength=shape[0]).astype(np.int64)
+        col_sums += sign * np.bincount(D.col, weights=D.data, minlength=shape[1]).astype(np.int64)
+        self.row_sums[role] = row_sums
+        self.col_sums[role] = col_sums
+
+    def get_delta_fp(self, stem: str, hash_: str) -> pathlib.Path:
+        return self.deltas_dir / f"{stem}.{hash_}.npz"
+
+    def save(self):
+        """Replace the saved state with the current state, then delete unused deltas."""
+        new_dir = self.store_dir / "state.new"
+        old_dir = self.store_dir / "state.old"
+        shutil.rmtree(new_dir, ignore_errors=True)
+        new_dir.mkdir(parents=True)
+
+        with open(new_dir / "books.json", "w", encoding="utf-8") as f:
+            json.dump(self.books, f)
+        for role in llr.ROLES:
+            role_dir = new_dir / role
+            role_dir.mkdir()
+            noun2i, feature2j = self.vocabs[role]
+            with open(role_dir / "nouns.json", "w", encoding="utf-8") as f:
+                json.dump(list(noun2i), f)
+            with open(role_dir / "features.json", "w", encoding="utf-8") as f:
+                json.dump(list(feature2j), f)
+            save_npz(role_dir / "F.npz", self.F[role])
+            np.save(role_dir / "row_sums.npy", self.row_sums[role])
+            np.save(role_dir / "col_sums.npy", self.col_sums[role])
+
+        shutil.rmtree(old_dir, ignore_errors=True)
+        if self.state_dir.exists():
+            self.state_dir.rename(old_dir)
+        new_dir.rename(self.state_dir)
+        shutil.rmtree(old_dir, ignore_errors=True)
+
+        used = set(self.get_delta_fp(stem, book["hash"]).name for stem, book in self.books.items())
+        for fp in self.deltas_dir.glob("*.npz"):
+            if fp.name not in used:
+                fp.unlink()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
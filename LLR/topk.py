@@ -0,0 +1,122 @@
+""" top-k association indexes of L, i.e., per noun its features, and per feature its
+nouns, by descending llr
+
+Saved next to llr_profiles by llr.save_role, as uncompressed .npz files of CSR-like arrays:
+    top_features.npz  i.e., per row (noun) i, indices[indptr[i]:indptr[i + 1]] are its
+        features, and llr[...] their llr, by descending llr (ties by index)
+    top_nouns.npz  i.e., as per top_features, per col (feature)
+
+Each holds the k highest of each row (or col), given config["top_k"], else all of its
+nonzeros. Where L is a CSR dir (i.e., config["llr_block_mb"], see blocked.py), each is
+instead a dir (top_features/, top_nouns/) of memory-mappable .npy files, built block by
+block of rows of L, and of its blocked transpose, s.t., L is never held in memory. A lookup
+of the top k is then a slice, e.g.,
+    top_nouns = load_topk(save_dir / "top_nouns.npz")  # else save_dir / "top_nouns"
+    get_top(top_nouns, feature2j["savage"], k=100)  # i.e., [(noun i, llr), ...]
+
+Note: nan llr (i.e., where a noun is the only noun of a role) are ordered last
+"""
+
+import pathlib
+import shutil
+import typing
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+
+def save_topk(save_dir: pathlib.Path, L: csr_matrix, *, k: typing.Union[int, None] = None):
+    """Save the top k (else all) features per noun, and nouns per feature, of L to save_dir."""
+    L = csr_matrix(L)
+    np.savez(save_dir / "top_features.npz", **get_topk(L, k=k))
+    np.savez(save_dir / "top_nouns.npz", **get_topk(L.T.tocsr(), k=k))
+
+
+def save_topk_blocked(
+    save_dir: pathlib.Path, L_dir: pathlib.Path, *, k: typing.Union[int, None] = None, block_nnz: int
+):
+    """Save the top-k indexes of the CSR dir L_dir to save_dir, as per save_topk, but as
+    dirs of .npy files, block by block of (at most) block_nnz nonzeros."""
+    import blocked
+
+    write_topk_blocked(L_dir, save_dir / "top_features", k=k, block_nnz=block_nnz)
+
+    T_dir = save_dir / "llr_profiles.T"  # i.e., temporary
+    blocked.transpose_csr(L_dir, T_dir, block_nnz=block_nnz)
+    write_topk_blocked(T_dir, save_dir / "top_nouns", k=k, block_nnz=block_nnz)
+    shutil.rmtree(T_dir)
+
+
+def write_topk_blocked(
+    csr_dir: pathlib.Path, topk_dir: pathlib.Path, *, k: typing.Union[int, None] = None, block_nnz: int
+):
+    """Write the top-k index of the CSR dir csr_dir (i.e., per row) to topk_dir, via
+    get_topk per block of rows, into memory-mapped arrays."""
+    import blocked
+
+    data, indices, indptr, shape = blocked.open_csr(csr_dir)
+    counts = np.diff(indptr)
+    if k is not None:
+        counts = np.minimum(counts, k)
+    topk_indptr = np.zeros(shape[0] + 1, dtype=np.int64)
+    np.cumsum(counts, out=topk_indptr[1:])
+
+    topk_dir.mkdir(parents=True, exist_ok=True)
+    np.save(topk_dir / "indptr.npy", topk_indptr)
+    nnz = int(topk_indptr[-1])
+    topk_indices = np.lib.format.open_memmap(topk_dir / "indices.npy", mode="w+", dtype=np.int32, shape=(nnz,))
+    topk_llr = np.lib.format.open_memmap(topk_dir / "llr.npy", mode="w+", dtype=data.dtype, shape=(nnz,))
+
+    for r0, r1 in blocked.get_blocks(indptr, block_nnz):
+        lo, hi = indptr[r0], indptr[r1]
+        block = csr_matrix(
+            (np.array(data[lo:hi]), np.array(indices[lo:hi]), np.array(indptr[r0 : r1 + 1]) - lo),
+            shape=(r1 - r0, shape[1]),
+        )
+        top = get_topk(block, k=k)
+        topk_indices[topk_indptr[r0] : topk_indptr[r1]] = top["indices"]
+        topk_llr[topk_indptr[r0] : topk_indptr[r1]] = top["llr"]
+
+    topk_indices.flush()
+    topk_llr.flush()
+
+
+def get_topk(L: csr_matrix, *, k: typing.Union[int, None] = None) -> dict[str, np.ndarray]:
+    """Return {"indptr", "indices", "llr"}, i.e., per row of L, its col indices and llr by
+    descending llr, truncated to k per row (if given), in one sort over the nonzeros."""
+    L = csr_matrix(L)
+    L.sum_duplicates()
+    rows = np.repeat(np.arange(L.shape[0]), np.diff(L.indptr))
+
+    # i.e., by row, then descending llr, then col
+    order = np.lexsort((L.indices, -L.data, rows))
+    indices = L.indices[order]
+    llr = L.data[order]
+    counts = np.diff(L.indptr)
+
+    if k is not None:
+        # i.e., the rank of each (sorted) nonzero within its row
+        ranks = np.arange(L.nnz) - np.repeat(L.indptr[:-1], counts)
+        keep = ranks < k
+        indices, llr = indices[keep], llr[keep]
+        counts = np.minimum(counts, k)
+
+    indptr = np.zeros(L.shape[0] + 1, dtype=np.int64)
+    np.cumsum(counts, out=indptr[1:])
+    return {"indptr": indptr, "indices": indices.astype(np.int32), "llr": llr}
+
+
+def load_topk(fp: pathlib.Path) -> dict[str, np.ndarray]:
+    """Return the arrays of the top-k index at fp, i.e., memory-mapped where fp is a dir."""
+    if fp.is_dir():
+        return {name: np.load(fp / f"{name}.npy", mmap_mode="r") for name in ["indptr", "indices", "llr"]}
+    with np.load(fp) as topk:
+        return {name: topk[name] for name in ["indptr", "indices", "llr"]}
+
+
+def get_top(topk: dict[str, np.ndarray], i: int, *, k: typing.Union[int, None] = None) -> list[tuple]:
+    """Return [(index, llr), ...] of the top k (else all indexed) of row (or col) i."""
+    lo, hi = topk["indptr"][i], topk["indptr"][i + 1]
+    if k is not None:
+        hi = min(hi, lo + k)
+    return list(zip(topk["indices"][lo:hi].tolist(), topk["llr"][lo:hi].tolist()))
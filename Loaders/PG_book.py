@@ -2,8 +2,12 @@
 loaders for chunks of text from Project Gutenberg books
 
 See the available loader for details of the returned info format: 
-    * sentences()
-    * paragraphs()
+    * as_parts()
+    * as_sentences()
+    * as_paragraphs()
+
+Note: loaders return (start, end) spans over the cleaned book body, rather than
+copies of the text, see gen_texts()
 """
 
 import pathlib
@@ -15,60 +19,159 @@ from multiprocessing.pool import Pool
 import orjson
 import pandas as pd
 
+# bump when a change to the cleaning or segmentation changes loader outputs
+# (invalidates Loaders.cache entries)
+VERSION = 1
+
+
+# one compiled scanner per segmentation level, applied over the whole cleaned body
+SENTENCE_SCANNER = re.compile(r"([^\.!?]*[\.!?])\s*")
+SENTENCE_PART_SCANNER = re.compile(r"([^\.!?,;:]*[\.!?,;:])\s*")
+
 
 def as_parts_star(t: tuple) -> pd.DataFrame:
-    return as_sentences(*t)
+    return as_parts(*t)
 
 
-def as_parts(fp: pathlib.Path, dictionary: list[str]) -> typing.Generator:
-    """Return a df::pd.Dataframe wrt., the passed fp, with cols "label", "text"
-    where 'text' is a sentence part, and 'label' is paragraph_i, sentence_part_i
+def as_parts(fp: pathlib.Path, dictionary: list[str]) -> pd.DataFrame:
+    """Return a df::pd.Dataframe wrt., the passed fp, with cols "label", "start", "end"
+    where [start, end) is the span of a sentence part in the cleaned book body,
+    and 'label' is paragraph_i, sentence_part_i
+
+    Note: the cleaned body is held in df.attrs["body"], see gen_texts()
     """
-    # build a dict of sentences, labelled as paragraph/ sentence within paragraph
-    d = {"label": [], "text": []}
-    for paragraph_i, paragraph in enumerate(gen_paragraphs(fp, dictionary=dictionary)):
-        for sentence_part_i, sentence_part in enumerate(gen_sentences_parts(paragraph)):
+    body, paragraph_spans = get_body(fp, dictionary=dictionary)
+
+    # build a dict of sentence part spans, labelled as paragraph/ sentence part within paragraph
+    d = {"label": [], "start": [], "end": []}
+    for paragraph_i, (p_start, p_end) in enumerate(paragraph_spans):
+        for sentence_part_i, (start, end) in enumerate(
+            gen_sentences_parts_spans(body, p_start, p_end)
+        ):
             d["label"].append([paragraph_i, sentence_part_i])
-            d["text"].append(sentence_part)
+            d["start"].append(start)
+            d["end"].append(end)
 
-    return pd.DataFrame(d)
+    df = pd.DataFrame(d)
+    df.attrs["body"] = body
+    return df
 
 
 def as_sentences_star(t: tuple) -> pd.DataFrame:
     return as_sentences(*t)
 
 
-def as_sentences(fp: pathlib.Path, dictionary: list[str]) -> typing.Generator:
-    """Return a df::pd.Dataframe wrt., the passed fp, with cols "label", "text"
-    where 'text' is a sentence, and 'label' is paragraph_i, sentence_i
+def as_sentences(fp: pathlib.Path, dictionary: list[str]) -> pd.DataFrame:
+    """Return a df::pd.Dataframe wrt., the passed fp, with cols "label", "start", "end"
+    where [start, end) is the span of a sentence in the cleaned book body,
+    and 'label' is paragraph_i, sentence_i
+
+    Note: the cleaned body is held in df.attrs["body"], see gen_texts()
     """
-    # build a dict of sentences, labelled as paragraph/ sentence within paragraph
-    d = {"label": [], "text": []}
-    for paragraph_i, paragraph in enumerate(gen_paragraphs(fp, dictionary=dictionary)):
-        for sentence_i, sentence in enumerate(gen_sentences(paragraph)):
+    body, paragraph_spans = get_body(fp, dictionary=dictionary)
+
+    # build a dict of sentence spans, labelled as paragraph/ sentence within paragraph
+    d = {"label": [], "start": [], "end": []}
+    for paragraph_i, (p_start, p_end) in enumerate(paragraph_spans):
+        for sentence_i, (start, end) in enumerate(
+            gen_sentences_spans(body, p_start, p_end)
+        ):
             d["label"].append([paragraph_i, sentence_i])
-            d["text"].append(sentence)
+            d["start"].append(start)
+            d["end"].append(end)
 
-    return pd.DataFrame(d)
+    df = pd.DataFrame(d)
+    df.attrs["body"] = body
+    return df
 
 
 def as_paragraphs_star(t: tuple) -> pd.DataFrame:
     return as_paragraphs(*t)
 
 
-def as_paragraphs(fp: pathlib.Path, dictionary: set[str]) -> typing.Generator:
-    """Return a df::pd.Dataframe wrt., the passed fp, with cols "label", "text"
-    where 'text' is a paragraph
+def as_paragraphs(fp: pathlib.Path, dictionary: set[str]) -> pd.DataFrame:
+    """Return a df::pd.Dataframe wrt., the passed fp, with cols "label", "start", "end"
+    where [start, end) is the span of a paragraph in the cleaned book body
+
+    Note: the cleaned body is held in df.attrs["body"], see gen_texts()
     """
-    # build a dict of paragraphs
-    d = {"label": [], "text": []}
+    body, paragraph_spans = get_body(fp, dictionary=dictionary)
 
-    for paragraph_i, paragraph in enumerate(gen_paragraphs(fp, dictionary=dictionary)):
+    # build a dict of paragraph spans
+    d = {"label": [], "start": [], "end": []}
+    for paragraph_i, (start, end) in enumerate(paragraph_spans):
         d["label"].append(paragraph_i)
-        d["text"].append(paragraph)
+        d["start"].append(start)
+        d["end"].append(end)
+
+    # return a dataframe corresponding to fp
+    df = pd.DataFrame(d)
+    df.attrs["body"] = body
+    return df
+
+
+def gen_texts(df: pd.DataFrame) -> typing.Generator:
+    """Return a generator of the text of each df row, sliced lazily from df.attrs["body"].
+
+    Note: the texts of a df of a "text" col (i.e., of loaders copying the text) are as is
+    """
+    if "text" in df.columns:
+        yield from df["text"]
+    else:
+        body = df.attrs["body"]
+        for start, end in zip(df["start"], df["end"]):
+            yield body[start:end]
+
+
+def get_body(fp: pathlib.Path, *, dictionary: set[str]) -> tuple[str, list[tuple]]:
+    """Return a (body::str, paragraph_spans::list[tuple]) tuple for the book at fp.
+
+    Note: body is the cleaned paragraphs (see gen_paragraphs) joined by '\n\n'
+    Note: paragraph_spans[i] is the (start, end) span of paragraph i in body
+    """
+    paragraphs = list(gen_paragraphs(fp, dictionary=dictionary))
 
-        # return a dataframe corresponding to fp
-    return pd.DataFrame(d)
+    paragraph_spans = []
+    start = 0
+    for paragraph in paragraphs:
+        end = start + len(paragraph)
+        paragraph_spans.append((start, end))
+        start = end + 2  # i.e., skip the '\n\n' separator
+
+    return "\n\n".join(paragraphs), paragraph_spans
+
+
+def gen_spans(
+    scanner: re.Pattern, text: str, start: int = 0, end: typing.Union[int, None] = None
+) -> typing.Generator:
+    """Return a generator of (start, end) spans in text, of scanner's first group,
+    scanning text[start:end] only (without copying it).
+    """
+    end = len(text) if end is None else end
+    for match in scanner.finditer(text, start, end):
+        span_start, span_end = match.span(1)
+        if span_end > span_start:
+            yield span_start, span_end
+
+
+def gen_sentences_spans(
+    body: str, start: int = 0, end: typing.Union[int, None] = None
+) -> typing.Generator:
+    """Return a generator of (start, end) sentence spans for paragraph body[start:end].
+
+    Note: assumes paragraph free of '\n'
+    """
+    return gen_spans(SENTENCE_SCANNER, body, start, end)
+
+
+def gen_sentences_parts_spans(
+    body: str, start: int = 0, end: typing.Union[int, None] = None
+) -> typing.Generator:
+    """Return a generator of (start, end) sentence part spans for paragraph body[start:end].
+
+    Note: assumes paragraph free of '\n'
+    """
+    return gen_spans(SENTENCE_PART_SCANNER, body, start, end)
 
 
 def gen_sentences(paragraph: str) -> typing.Generator:
@@ -76,9 +179,8 @@ def gen_sentences(paragraph: str) -> typing.Generator:
 
     Note: assumes paragraph free of '\n'
     """
-    for sentence in re.findall(r"([^\.!?]*[\.!?])\s*", paragraph):
-        if sentence:
-            yield sentence
+    for start, end in gen_sentences_spans(paragraph):
+        yield paragraph[start:end]
 
 
 def gen_sentences_parts(paragraph: str) -> typing.Generator:
@@ -86,9 +188,8 @@ def gen_sentences_parts(paragraph: str) -> typing.Generator:
 
     Note: assumes paragraph free of '\n'
     """
-    for sentence_part in re.findall(r"([^\.!?,;:]*[\.!?,;:])\s*", paragraph):
-        if sentence_part:
-            yield sentence_part
+    for start, end in gen_sentences_parts_spans(paragraph):
+        yield paragraph[start:end]
 
 
 def gen_paragraphs(fp: pathlib.Path, *, dictionary: set[str]) -> typing.Generator:
@@ -100,8 +201,8 @@ def gen_paragraphs(fp: pathlib.Path, *, dictionary: set[str]) -> typing.Generato
     """
 
     # open the doc
-    with open(fp, "r", encoding="utf-8") as f:
-        doc = f.read()
+    # Note: fp may be a pathlib.Path or a Loaders.shards.ShardBook
+    doc = fp.read_text(encoding="utf-8")
 
     # ignore the extraneous PG text, take only the book
     match = re.search(
@@ -0,0 +1,113 @@
+"""
+a cache of preprocessed (i.e., cleaned and segmented) books, wrt., some loader
+
+Each book's loader output is saved as an uncompressed .npz of:
+    * body: the cleaned book body, as utf-8 bytes
+    * one array per df col, e.g., label, start, end
+
+The cache key is a hash of the raw book bytes, the dictionary and the loader
+(name and module VERSION), so changing any of them invalidates the entry.
+"""
+
+import hashlib
+import io
+import os
+import pathlib
+import typing
+
+import numpy as np
+import pandas as pd
+
+
+class CachedLoader:
+    def __init__(
+        self,
+        loader: typing.Callable,
+        cache_dir: pathlib.Path,
+        dictionary_fp: pathlib.Path,
+    ):
+        """Wrap loader, s.t., calls are served from cache_dir where possible.
+
+        Args:
+            loader (typing.Callable): e.g., Loaders.PG_book.as_parts
+            cache_dir (pathlib.Path): where cached books are saved
+            dictionary_fp (pathlib.Path): the dictionary file passed (as a set) to the loader
+        """
+        self.loader = loader
+        self.cache_dir = pathlib.Path(cache_dir).expanduser().resolve()
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+        # hash of everything but the book itself
+        h = hashlib.blake2b(digest_size=16)
+        with open(pathlib.Path(dictionary_fp).expanduser().resolve(), "rb") as f:
+            h.update(f.read())
+        h.update(get_loader_id(loader).encode("utf-8"))
+        self.settings_hash = h.hexdigest()
+
+    def __call__(self, fp: pathlib.Path, dictionary: set[str]) -> pd.DataFrame:
+        """Return the loader output wrt., fp, from cache if available."""
+
+        key = self.get_key(fp)
+        cache_fp = self.cache_dir / f"{fp.stem}.{key}.npz"
+
+        if cache_fp.exists():
+            return load(cache_fp)
+
+        df = self.loader(fp, dictionary)
+
+        # remove stale entries wrt., the book, before saving the new one
+        for stale_fp in self.cache_dir.glob(f"{fp.stem}.*.npz"):
+            stale_fp.unlink(missing_ok=True)
+        save(df, cache_fp)
+
+        return df
+
+    def get_key(self, fp: pathlib.Path) -> str:
+        """Return the cache key wrt., book fp and the loader settings."""
+        h = hashlib.blake2b(digest_size=16)
+        h.update(fp.read_bytes())
+        h.update(self.settings_hash.encode("utf-8"))
+        return h.hexdigest()
+
+
+def get_loader_id(loader: typing.Callable) -> str:
+    """Return e.g., 'Loaders.PG_book.as_parts@1', i.e., loader name @ module VERSION"""
+    module = __import__(loader.__module__, fromlist=["VERSION"])
+    version = getattr(module, "VERSION", 0)
+    return f"{loader.__module__}.{loader.__qualname__}@{version}"
+
+
+def save(df: pd.DataFrame, fp: pathlib.Path):
+    """Save loader output df (with df.attrs["body"]) to fp, atomically."""
+
+    arrays = {"body": np.frombuffer(df.attrs["body"].encode("utf-8"), dtype=np.uint8)}
+    for col in df.columns:
+        array = np.array(df[col].tolist())
+        # i.e., labels and spans comfortably fit int32
+        if array.dtype.kind == "i" and (array.size == 0 or abs(array).max() < 2**31):
+            array = array.astype(np.int32)
+        arrays[f"col_{col}"] = array
+
+    # write to a temp file, then rename, s.t., a crash never leaves a partial entry
+    buffer = io.BytesIO()
+    np.savez(buffer, **arrays)
+    tmp_fp = fp.with_name(f".{fp.name}.{os.getpid()}.tmp")
+    with open(tmp_fp, "wb") as f:
+        f.write(buffer.getbuffer())
+    os.replace(tmp_fp, fp)
+
+
+def load(fp: pathlib.Path) -> pd.DataFrame:
+    """Return the loader output df saved at fp."""
+
+    with np.load(fp) as npz:
+        d = {
+            name[len("col_") :]: npz[name].tolist()
+            for name in npz.files
+            if name.startswith("col_")
+        }
+        body = npz["body"].tobytes().decode("utf-8")
+
+    df = pd.DataFrame(d)
+    df.attrs["body"] = body
+    return df
@@ -0,0 +1,271 @@
+"""
+a packed corpus format: many small book files, packed into a few large shard files
+
+A packed corpus dir contains:
+    * shard_00000.bin, shard_00001.bin, ...: concatenated (optionally zlib compressed) books
+    * index.json: {"version", "compression", "shards", "books": {name: [shard_i, offset, length]}}
+
+Books are read back as ShardBook objects, which quack like the pathlib.Path objects
+the loaders expect (i.e., .name, .stem, .read_bytes(), .read_text()).
+
+Pack an existing dir of books:
+    python3 -m Loaders.shards PS PS_packed --pattern "txt$" --compress
+
+Packing into an existing packed corpus appends to it, i.e., its books are kept, and new
+books are written to new shards, e.g., a rerun to fetch the books that failed.
+"""
+
+import argparse
+import io
+import json
+import os
+import pathlib
+import re
+import sys
+import typing
+import zlib
+
+from tqdm import tqdm
+
+INDEX_NAME = "index.json"
+VERSION = 1
+
+
+class ShardWriter:
+    def __init__(
+        self,
+        out_dir: pathlib.Path,
+        *,
+        shard_bytes: int = 256 * 2**20,
+        compress: bool = False,
+    ):
+        """Pack books into out_dir, starting a new shard after every ~shard_bytes, appending
+        to the packed corpus in out_dir (if any), i.e., continuing from its last shard.
+
+        Note: use as a context manager, or call close(), to write the index
+        """
+        self.out_dir = pathlib.Path(out_dir).expanduser().resolve()
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        self.shard_bytes = shard_bytes
+        self.compression = "zlib" if compress else None
+
+        self.shards: list[str] = []
+        self.books: dict[str, list[int]] = {}
+        self.f = None
+        self.offset = 0
+
+        if is_packed(self.out_dir):
+            with open(self.out_dir / INDEX_NAME, "r", encoding="utf-8") as f:
+                index = json.load(f)
+            if index["compression"] != self.compression:
+                raise ValueError(
+                    f"{self.out_dir} is packed with compression {index['compression']}, not {self.compression}"
+                )
+            self.shards = index["shards"]
+            self.books = index["books"]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.books
+
+    def add(self, name: str, data: bytes):
+        """Append book data under name, e.g., "15.txt"."""
+
+        if name in self.books:
+            raise ValueError(f"{name} already packed")
+
+        if self.f is None or self.offset >= self.shard_bytes:
+            self._new_shard()
+
+        if self.compression == "zlib":
+            data = zlib.compress(data)
+
+        self.f.write(data)
+        self.books[name] = [len(self.shards) - 1, self.offset, len(data)]
+        self.offset += len(data)
+
+    def close(self):
+        """Close the current shard and (atomically) write the index."""
+
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+        index = {
+            "version": VERSION,
+            "compression": self.compression,
+            "shards": self.shards,
+            "books": self.books,
+        }
+        tmp_fp = self.out_dir / f".{INDEX_NAME}.tmp"
+        with open(tmp_fp, "w", encoding="utf-8") as f:
+            json.dump(index, f)
+        os.replace(tmp_fp, self.out_dir / INDEX_NAME)
+
+    def _new_shard(self):
+        if self.f is not None:
+            self.f.close()
+        shard_name = f"shard_{len(self.shards):05d}.bin"
+        self.shards.append(shard_name)
+        self.f = open(self.out_dir / shard_name, "wb")
+        self.offset = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ShardedCorpus:
+    def __init__(self, corpus_dir: pathlib.Path):
+        """A packed corpus, readable sequentially (iteration) or by book name."""
+
+        self.corpus_dir = pathlib.Path(corpus_dir).expanduser().resolve()
+        with open(self.corpus_dir / INDEX_NAME, "r", encoding="utf-8") as f:
+            index = json.load(f)
+        self.compression = index["compression"]
+        self.shards: list[str] = index["shards"]
+        self.books: dict[str, list[int]] = index["books"]
+        self._handles = {}
+
+    def __len__(self) -> int:
+        return len(self.books)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.books
+
+    def __getitem__(self, name: str) -> "ShardBook":
+        return ShardBook(self, name)
+
+    def __iter__(self) -> typing.Iterator["ShardBook"]:
+        """Iterate over books in shard, offset order, i.e., sequential reads."""
+        for name in sorted(self.books, key=lambda name: self.books[name][:2]):
+            yield ShardBook(self, name)
+
+    def read_bytes(self, name: str) -> bytes:
+        """Return the (decompressed) bytes of book name."""
+
+        shard_i, offset, length = self.books[name]
+
+        # keep shard files open, s.t., sequential reads cost no further opens
+        if shard_i not in self._handles:
+            self._handles[shard_i] = open(self.corpus_dir / self.shards[shard_i], "rb")
+        f = self._handles[shard_i]
+        f.seek(offset)
+        data = f.read(length)
+
+        if self.compression == "zlib":
+            data = zlib.decompress(data)
+        return data
+
+    def __getstate__(self):
+        # i.e., file handles are not passed to worker processes
+        state = self.__dict__.copy()
+        state["_handles"] = {}
+        return state
+
+
+class ShardBook:
+    def __init__(self, corpus: ShardedCorpus, name: str):
+        """A book in a packed corpus, usable in place of a pathlib.Path by the loaders."""
+        self.corpus = corpus
+        self.name = name
+        self.stem = name.rsplit(".", 1)[0] if "." in name else name
+
+    @property
+    def size(self) -> int:
+        """Return the packed length of the book, in bytes."""
+        return self.corpus.books[self.name][2]
+
+    def read_bytes(self) -> bytes:
+        return self.corpus.read_bytes(self.name)
+
+    def read_text(self, encoding: str = "utf-8") -> str:
+        # as per open(..., "r"), i.e., with universal newlines
+        return io.TextIOWrapper(io.BytesIO(self.read_bytes()), encoding=encoding).read()
+
+    def __str__(self) -> str:
+        return f"{self.corpus.corpus_dir / INDEX_NAME}#{self.name}"
+
+    def __repr__(self) -> str:
+        return f"ShardBook({str(self)!r})"
+
+
+def is_packed(dir_path: pathlib.Path) -> bool:
+    """Return True if dir_path is a packed corpus."""
+    return (pathlib.Path(dir_path) / INDEX_NAME).exists()
+
+
+def resolve(s: str) -> typing.Union[pathlib.Path, ShardBook]:
+    """Return the pathlib.Path or ShardBook corresponding to str(book)."""
+    if "#" in s:
+        index_fp, name = s.split("#", 1)
+        return get_corpus(pathlib.Path(index_fp).parent)[name]
+    else:
+        return pathlib.Path(s)
+
+
+_corpora: dict = {}
+
+
+def get_corpus(corpus_dir: pathlib.Path) -> ShardedCorpus:
+    """Return the (per-process, memoized) ShardedCorpus at corpus_dir."""
+    corpus_dir = pathlib.Path(corpus_dir).expanduser().resolve()
+    if corpus_dir not in _corpora:
+        _corpora[corpus_dir] = ShardedCorpus(corpus_dir)
+    return _corpora[corpus_dir]
+
+
+def gen_books(
+    dir_path: pathlib.Path, *, pattern: re.Pattern = re.compile(".+")
+) -> typing.Generator:
+    """Return a generator of books in dir_path with names matching pattern,
+    i.e., ShardBook objects if dir_path is a packed corpus, else pathlib.Path objects.
+    """
+    if is_packed(dir_path):
+        for book in get_corpus(dir_path):
+            if re.search(pattern, book.name):
+                yield book
+    else:
+        for fp in sorted(pathlib.Path(dir_path).glob("*")):
+            if fp.is_file() and re.search(pattern, str(fp)):
+                yield fp
+
+
+def pack_dir(
+    src_dir: pathlib.Path,
+    out_dir: pathlib.Path,
+    *,
+    pattern: re.Pattern = re.compile(".+"),
+    shard_bytes: int = 256 * 2**20,
+    compress: bool = False,
+):
+    """Pack the files in src_dir matching pattern into a packed corpus at out_dir, i.e.,
+    appending those not already packed."""
+    fps = list(gen_books(pathlib.Path(src_dir).expanduser().resolve(), pattern=pattern))
+    with ShardWriter(out_dir, shard_bytes=shard_bytes, compress=compress) as writer:
+        for fp in tqdm([fp for fp in fps if fp.name not in writer]):
+            writer.add(fp.name, fp.read_bytes())
+
+
+def main(args):
+
+    arg_parser = argparse.ArgumentParser(description="pack a dir of books into shards")
+    arg_parser.add_argument("src_dir")
+    arg_parser.add_argument("out_dir")
+    arg_parser.add_argument("--pattern", default=".+", help="re.search pattern of wanted files")
+    arg_parser.add_argument("--shard-mb", type=int, default=256)
+    arg_parser.add_argument("--compress", action="store_true", help="zlib compress each book")
+    args = arg_parser.parse_args(args)
+
+    pack_dir(
+        args.src_dir,
+        args.out_dir,
+        pattern=re.compile(args.pattern),
+        shard_bytes=args.shard_mb * 2**20,
+        compress=args.compress,
+    )
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
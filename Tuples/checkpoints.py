@@ -0,0 +1,160 @@
+""" atomic output writes, per-chunk checkpoints and output validation for pipeline.py
+
+Each completed chunk of a multi-chunk book (see pipeline.CHUNK_BYTES) is checkpointed to
+output_dir/.partial/<stem>.<key>/<chunk_i>_<n_chunks>.json, s.t., a restarted run only
+processes the book's remaining chunks. Checkpoints are removed once the book is saved.
+The key is a hash of the book's input (size and mtime), config and patterns hashes (see
+ledger.py), s.t., a book re-queued due to a change of any of them never resumes from
+checkpoints made before the change.
+
+The loader output of a multi-chunk book is likewise saved once, to
+output_dir/.partial/<stem>.<key>/loaded.npz (see get_loaded), s.t., the book is cleaned
+and segmented once, rather than once per chunk.
+
+Validate (i.e., remove truncated or otherwise unreadable) outputs, s.t., the next
+pipeline.py run re-queues them:
+    python3 checkpoints.py
+"""
+
+import fcntl
+import glob
+import hashlib
+import json
+import os
+import pathlib
+import shutil
+import typing
+
+import pandas as pd
+
+import Loaders.cache
+import tuple_output
+from ledger import get_input_stat
+
+PARTIAL_DIR = ".partial"
+
+
+def save_json(fp: pathlib.Path, obj: typing.Any) -> str:
+    """Save obj as json to fp, atomically, i.e., via a temp file and rename.
+    Return the hash of the saved file.
+
+    Note: a crash mid-write leaves only a (hidden) temp file, never a partial fp
+    """
+    data = json.dumps(obj).encode("utf-8")
+    tmp_fp = fp.with_name(f".{fp.name}.{os.getpid()}.tmp")
+    with open(tmp_fp, "wb") as f:
+        f.write(data)
+    os.replace(tmp_fp, fp)
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def get_partial_dir(output_dir: pathlib.Path, book, config_hash: str, patterns_hash: str) -> pathlib.Path:
+    """Return the dir of the book's checkpoints, wrt., its current input, config and patterns."""
+    return output_dir / PARTIAL_DIR / f"{book.stem}.{get_book_key(book, config_hash, patterns_hash)}"
+
+
+def get_book_key(book, config_hash: str, patterns_hash: str) -> str:
+    """Return a hash of the book's current input (size and mtime), config and patterns,
+    keying its checkpoints (and leases, see pipeline.get_task_id)."""
+    return hashlib.blake2b(
+        json.dumps([get_input_stat(book), config_hash, patterns_hash]).encode("utf-8"), digest_size=8
+    ).hexdigest()
+
+
+def save_checkpoint(partial_dir: pathlib.Path, chunk_i: int, n_chunks: int, result):
+    """Checkpoint the result of chunk_i (of n_chunks) of the book of partial_dir."""
+    partial_dir.mkdir(parents=True, exist_ok=True)
+    save_json(partial_dir / f"{chunk_i}_{n_chunks}.json", result)
+
+
+def get_checkpointed(partial_dir: pathlib.Path, n_chunks: int) -> set[int]:
+    """Return the chunk_is of the book of partial_dir already checkpointed, wrt., n_chunks.
+
+    Note: checkpoints wrt., a different n_chunks (e.g., after changing chunk_bytes) are ignored
+    """
+    chunk_is = set()
+    if partial_dir.exists():
+        for fp in partial_dir.glob(f"*_{n_chunks}.json"):
+            chunk_is.add(int(fp.stem.split("_")[0]))
+    return chunk_is
+
+
+def get_loaded(partial_dir: pathlib.Path, load: typing.Callable[[], pd.DataFrame]) -> pd.DataFrame:
+    """Return the loader output of the book of partial_dir, where load() is run at most
+    once over the workers (and processes) working on its chunks, i.e., the first to arrive
+    runs it and saves its output to partial_dir, while any others wait, then read it.
+
+    Note: processes sharing an output_dir coordinate via a lock file, see fcntl.flock
+    """
+    partial_dir.mkdir(parents=True, exist_ok=True)
+    loaded_fp = partial_dir / "loaded.npz"
+    with open(partial_dir / "loaded.lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            if loaded_fp.exists():
+                return Loaders.cache.load(loaded_fp)
+            df = load()
+            Loaders.cache.save(df, loaded_fp)
+            return df
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def load_checkpoint(partial_dir: pathlib.Path, chunk_i: int, n_chunks: int):
+    with open(partial_dir / f"{chunk_i}_{n_chunks}.json", "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def remove_checkpoints(output_dir: pathlib.Path, stem: str):
+    """Remove the checkpoints of book stem, wrt., any (i.e., incl., stale) key."""
+    for partial_dir in (output_dir / PARTIAL_DIR).glob(f"{glob.escape(stem)}.*"):
+        if partial_dir.name.rsplit(".", 1)[0] == stem:
+            shutil.rmtree(partial_dir, ignore_errors=True)
+
+
+def validate(output_dir: pathlib.Path) -> list[pathlib.Path]:
+    """Remove (and return) outputs in output_dir which are not complete, i.e., truncated
+    or unreadable, s.t., they are re-queued. Also removes stale temp files.
+
+    Note: legacy .json outputs (a list of alternating spans and tuple lists) are also checked
+    """
+    removed = []
+    for fp in output_dir.glob(".*.tmp"):
+        fp.unlink(missing_ok=True)
+    for fp in output_dir.glob(f"*{tuple_output.EXT}"):
+        try:
+            tuple_output.read_encoded(fp)
+        except (ValueError, KeyError):
+            fp.unlink()
+            removed.append(fp)
+    for fp in output_dir.glob("*.json"):
+        try:
+            with open(fp, "r", encoding="utf-8") as f:
+                tuples = json.load(f)
+            ok = isinstance(tuples, list) and len(tuples) % 2 == 0
+        except (ValueError, UnicodeDecodeError):
+            ok = False
+        if not ok:
+            fp.unlink()
+            removed.append(fp)
+    return removed
+
+
+def main():
+
+    # load configs
+    with open("configs.json", "r") as f:
+        configs: list[dict] = json.loads(f.read())
+
+    for config in configs:
+        if config["switch"] == True:
+            output_dir = pathlib.Path(config["output_dir"]).expanduser().resolve()
+            if output_dir.exists():
+                removed = validate(output_dir)
+                print(f"{config['set']}: removed {len(removed)} invalid outputs")
+                for fp in removed:
+                    print(f"\t{fp.name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -12,7 +12,7 @@ def main():
 
 
         in_fps = pathlib.Path(in_dir).glob('*txt')
-        out_fps = pathlib.Path(out_dir).glob('*json')
+        out_fps = pathlib.Path(out_dir).glob('*jsonl')
 
         # get dicts of filename:filepath
         in_name2fp = {fp.stem:fp for fp in in_fps}
@@ -0,0 +1,229 @@
+""" identify near-duplicate books (reissues, volumes vs. collected editions) in the
+input of each switched-on config, via MinHash/LSH over word shingles of the
+cleaned paragraphs (i.e., the loader output).
+
+writes config["dedup_report"], listing clusters of near-duplicate books and the one
+book kept per cluster. pipeline.py then skips the dropped books.
+
+run:
+    python3 dedup.py
+"""
+
+import json
+import pathlib
+import re
+import zlib
+from collections import defaultdict
+from multiprocessing import Pool
+
+import numpy as np
+from tqdm import tqdm
+
+import Loaders.cache
+import Loaders.shards
+import registry
+
+# minhash settings
+SHINGLE_SIZE = 5  # words
+NUM_PERM = 128
+BANDS = 64  # i.e., rows per band = NUM_PERM / BANDS
+MAX_HASH = np.uint64((1 << 32) - 1)
+SEED = 10
+
+# a pair of books is a near-duplicate if the smaller is mostly contained in the larger
+CONTAINMENT_THRESHOLD = 0.8
+
+
+def main():
+
+    # load configs
+    with open("configs.json", "r") as f:
+        configs: list[dict] = json.loads(f.read())
+
+    for config in configs:
+        if config["switch"] == True and "dedup_report" in config:
+
+            input_dir = pathlib.Path(config["input"][0]).expanduser().resolve()
+            input_pattern = re.compile(config["input"][1])
+            fps = [str(fp) for fp in Loaders.shards.gen_books(input_dir, pattern=input_pattern)]
+            print(f"{config['set']}: minhash {len(fps)} books")
+
+            # get (stem, n_shingles, signature) wrt., each book
+            with Pool(
+                int(config["n_processes"]), initializer=init_worker, initargs=(config,)
+            ) as pool:
+                results = list(
+                    tqdm(pool.imap(get_signature_star, fps, chunksize=16), total=len(fps))
+                )
+            results = [r for r in results if r[1] > 0]  # i.e., ignore books without text
+
+            clusters = get_clusters(results)
+            report = get_report(clusters)
+            print(
+                f"{len(report['clusters'])} clusters, {len(report['dropped'])} books dropped"
+            )
+
+            # save
+            report_fp = pathlib.Path(config["dedup_report"]).expanduser().resolve()
+            report_fp.parent.mkdir(parents=True, exist_ok=True)
+            with open(report_fp, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=1)
+
+
+# per worker state, see init_worker
+_loader = None
+_dictionary = None
+
+
+def init_worker(config: dict):
+    """Load the loader and dictionary wrt., config, once per worker process."""
+    global _loader, _dictionary
+
+    _loader = registry.resolve("loader", config["loader"])
+    if config.get("cache_dir"):
+        _loader = Loaders.cache.CachedLoader(
+            _loader, config["cache_dir"], config["dictionary_fp"]
+        )
+
+    with open(
+        pathlib.Path(config["dictionary_fp"]).expanduser().resolve(),
+        "r",
+        encoding="utf-8",
+    ) as f:
+        _dictionary = set([w.strip("\n") for w in f.readlines()])
+
+
+def get_signature_star(fp: str) -> tuple:
+    return get_signature(Loaders.shards.resolve(fp))
+
+
+def get_signature(fp) -> tuple[str, int, np.ndarray]:
+    """Return (stem, n_shingles, minhash signature) wrt., the book at fp."""
+    df = _loader(fp, _dictionary)
+    shingles = get_shingles(df.attrs["body"])
+    return fp.stem, len(shingles), get_minhash(shingles)
+
+
+def get_shingles(body: str) -> np.ndarray:
+    """Return the unique (crc32 hashed) word shingles of the cleaned paragraphs in body."""
+    hashes = set()
+    for paragraph in body.split("\n\n"):
+        words = paragraph.lower().split()
+        for i in range(len(words) - SHINGLE_SIZE + 1):
+            hashes.add(zlib.crc32(" ".join(words[i : i + SHINGLE_SIZE]).encode("utf-8")))
+    return np.fromiter(hashes, dtype=np.uint64, count=len(hashes))
+
+
+def get_permutations() -> tuple[np.ndarray, np.ndarray]:
+    """Return the (a, b) coefficients of the NUM_PERM hash functions
+    ((a*x + b) mod 2**64) >> 32, i.e., multiply-shift hashing of 32 bit shingle hashes.
+    """
+    rng = np.random.default_rng(SEED)
+    a = rng.integers(0, 1 << 63, size=NUM_PERM, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+    b = rng.integers(0, 1 << 63, size=NUM_PERM, dtype=np.uint64)
+    return a, b
+
+
+PERM_A, PERM_B = get_permutations()
+
+
+def get_minhash(shingles: np.ndarray, chunk_size: int = 8192) -> np.ndarray:
+    """Return the NUM_PERM minhash signature of the shingles."""
+    signature = np.full(NUM_PERM, MAX_HASH, dtype=np.uint64)
+    with np.errstate(over="ignore"):  # i.e., mod 2**64 by design
+        for start in range(0, len(shingles), chunk_size):
+            x = shingles[start : start + chunk_size].reshape(-1, 1)
+            hashed = (PERM_A * x + PERM_B) >> np.uint64(32)  # (chunk, NUM_PERM)
+            signature = np.minimum(signature, hashed.min(axis=0))
+    return signature
+
+
+def get_clusters(results: list[tuple]) -> list[dict]:
+    """Return a list of near-duplicate clusters, as dicts of "books", "pairs".
+
+    Args:
+        results (list[tuple]): (stem, n_shingles, signature) wrt., each book
+    """
+    stems = [stem for stem, _, _ in results]
+    sizes = np.array([n for _, n, _ in results], dtype=float)
+    signatures = np.stack([signature for _, _, signature in results])
+
+    # candidate pairs, i.e., books sharing a bucket in any band
+    rows = NUM_PERM // BANDS
+    candidates = set()
+    for band in range(BANDS):
+        buckets = defaultdict(list)
+        for book_i, key in enumerate(
+            map(bytes, signatures[:, band * rows : (band + 1) * rows])
+        ):
+            buckets[key].append(book_i)
+        for bucket in buckets.values():
+            for x in range(len(bucket)):
+                for y in range(x + 1, len(bucket)):
+                    candidates.add((bucket[x], bucket[y]))
+
+    # verify candidates, via estimated containment of the smaller book in the larger
+    # Note: |A & B| = J/(1+J) * (|A| + |B|)
+    pairs = []
+    for x, y in sorted(candidates):
+        jaccard = (signatures[x] == signatures[y]).mean()
+        intersection = jaccard / (1 + jaccard) * (sizes[x] + sizes[y])
+        containment = min(intersection / min(sizes[x], sizes[y]), 1.0)
+        if containment >= CONTAINMENT_THRESHOLD:
+            pairs.append((x, y, float(jaccard), float(containment)))
+
+    # union-find over verified pairs
+    parent = list(range(len(stems)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for x, y, _, _ in pairs:
+        parent[find(x)] = find(y)
+
+    root2books = defaultdict(list)
+    root2pairs = defaultdict(list)
+    for x, y, jaccard, containment in pairs:
+        root2pairs[find(x)].append([stems[x], stems[y], jaccard, containment])
+    for book_i in range(len(stems)):
+        root2books[find(book_i)].append(book_i)
+
+    return [
+        {
+            "books": [(stems[i], int(sizes[i])) for i in books],
+            "pairs": root2pairs[root],
+        }
+        for root, books in root2books.items()
+        if len(books) > 1
+    ]
+
+
+def get_report(clusters: list[dict]) -> dict:
+    """Return a report of clusters, keeping the largest book (i.e., the one that
+    contains the others, e.g., the collected edition) in each cluster.
+    """
+    report = {"clusters": [], "dropped": []}
+    for cluster in clusters:
+        books = sorted(cluster["books"], key=lambda x: (-x[1], x[0]))
+        keep, drop = books[0][0], [stem for stem, _ in books[1:]]
+        report["clusters"].append({"keep": keep, "drop": drop, "pairs": cluster["pairs"]})
+        report["dropped"] += drop
+    report["dropped"] = sorted(report["dropped"])
+    return report
+
+
+def get_dropped(config: dict) -> set[str]:
+    """Return the set of book stems dropped by dedup, wrt., config (empty if not run)."""
+    if "dedup_report" in config:
+        report_fp = pathlib.Path(config["dedup_report"]).expanduser().resolve()
+        if report_fp.exists():
+            with open(report_fp, "r", encoding="utf-8") as f:
+                return set(json.load(f)["dropped"])
+    return set()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+""" a lease-based work queue on a shared filesystem (e.g., NFS), s.t., any number of
+pipeline.py processes, on any number of hosts, can share one set of tasks.
+
+In lease_dir, each task has:
+    * <task_id>.lease: held by the process working on the task (created with O_EXCL);
+      its mtime is refreshed by a heartbeat, and it expires after ttl seconds without one
+    * <task_id>.done: created once the task's result is saved
+
+Expired leases (i.e., of a lost worker or host) are broken, and the task re-claimed, by
+the next process to try it. Time is taken from the shared filesystem (the mtime of a
+freshly touched file), so hosts need not share a clock.
+
+Try it locally, by running several pipeline.py processes with the same "lease_dir":
+    python3 pipeline.py & python3 pipeline.py & python3 pipeline.py
+"""
+
+import os
+import pathlib
+import socket
+import threading
+import time
+import typing
+
+
+class LeaseQueue:
+    def __init__(self, lease_dir: pathlib.Path, *, ttl: float = 300):
+        """Leases in lease_dir, expiring after ttl seconds without a heartbeat.
+
+        Note: call start_heartbeat() to keep held leases alive
+        """
+        self.lease_dir = pathlib.Path(lease_dir).expanduser().resolve()
+        self.lease_dir.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.owner = f"{socket.gethostname()}.{os.getpid()}"
+        self.held: set[str] = set()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def claim(self, task_id: str) -> bool:
+        """Return True if the lease on task_id is now held by this process, i.e., it was
+        free, or expired (and broken), and the task is not done."""
+        if self.is_done(task_id):
+            return False
+
+        lease_fp = self._lease_fp(task_id)
+        if self._create(lease_fp):
+            return self._hold(task_id)
+
+        # held by another process ... unless expired
+        try:
+            owner = lease_fp.read_text()
+            mtime = lease_fp.stat().st_mtime
+        except FileNotFoundError:
+            return self._create(lease_fp) and self._hold(task_id)
+        if self.get_time() - mtime < self.ttl:
+            return False
+
+        # break the expired lease: only one process can rename it away
+        broken_fp = lease_fp.with_name(f"{lease_fp.name}.{self.owner}.broken")
+        try:
+            os.rename(lease_fp, broken_fp)
+        except FileNotFoundError:
+            return False
+        if broken_fp.read_text() != owner:
+            # i.e., renamed a fresh lease, taken since we looked: put it back
+            try:
+                os.link(broken_fp, lease_fp)
+            except FileExistsError:
+                pass
+            broken_fp.unlink(missing_ok=True)
+            return False
+        broken_fp.unlink(missing_ok=True)
+
+        return self._create(lease_fp) and self._hold(task_id)
+
+    def complete(self, task_id: str):
+        """Mark task_id done, and release its lease."""
+        self._done_fp(task_id).touch()
+        self.release(task_id)
+
+    def release(self, task_id: str):
+        """Release the lease on task_id (without marking it done), e.g., on failure."""
+        with self.lock:
+            self.held.discard(task_id)
+        self._lease_fp(task_id).unlink(missing_ok=True)
+
+    def reopen(self, task_id: str):
+        """Remove the done marker of task_id, e.g., where its result has since been lost."""
+        self._done_fp(task_id).unlink(missing_ok=True)
+
+    def is_done(self, task_id: str) -> bool:
+        return self._done_fp(task_id).exists()
+
+    def heartbeat(self):
+        """Refresh the mtime of every held lease."""
+        with self.lock:
+            held = list(self.held)
+        for task_id in held:
+            try:
+                os.utime(self._lease_fp(task_id))
+            except FileNotFoundError:
+                # i.e., broken by another process, after we failed to heartbeat in time
+                with self.lock:
+                    self.held.discard(task_id)
+
+    def start_heartbeat(self, interval: typing.Union[float, None] = None):
+        """Heartbeat held leases every interval (default: ttl/3) seconds, in a daemon thread."""
+        interval = self.ttl / 3 if interval is None else interval
+
+        def run():
+            while not self.stopped.wait(interval):
+                self.heartbeat()
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def stop(self):
+        """Stop heartbeating, and release all held leases."""
+        self.stopped.set()
+        with self.lock:
+            held = list(self.held)
+        for task_id in held:
+            self.release(task_id)
+
+    def get_time(self) -> float:
+        """Return the current time according to the shared filesystem."""
+        clock_fp = self.lease_dir / f".clock.{self.owner}"
+        clock_fp.touch()
+        os.utime(clock_fp)
+        return clock_fp.stat().st_mtime
+
+    def gen_claimed(
+        self, tasks: typing.Iterable, get_task_id: typing.Callable, *, poll: float = 30
+    ) -> typing.Generator:
+        """Return a generator of the tasks whose lease this process claims, see gen_claimed."""
+        return gen_claimed(tasks, lambda task: self, get_task_id, poll=poll)
+
+    def _create(self, lease_fp: pathlib.Path) -> bool:
+        try:
+            fd = os.open(lease_fp, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, "w") as f:
+            f.write(f"{self.owner} {time.time()}")
+        return True
+
+    def _hold(self, task_id: str) -> bool:
+        with self.lock:
+            self.held.add(task_id)
+        return True
+
+    def _lease_fp(self, task_id: str) -> pathlib.Path:
+        return self.lease_dir / f"{task_id}.lease"
+
+    def _done_fp(self, task_id: str) -> pathlib.Path:
+        return self.lease_dir / f"{task_id}.done"
+
+
+def gen_claimed(
+    tasks: typing.Iterable,
+    get_leases: typing.Callable,
+    get_task_id: typing.Callable,
+    *,
+    poll: float = 30,
+) -> typing.Generator:
+    """Return a generator of the tasks whose lease this process claims, i.e., skipping
+    done tasks, and revisiting tasks leased elsewhere (every poll seconds) until they are
+    done, or their lease expires and is claimed here.
+
+    Args:
+        get_leases (typing.Callable): return the LeaseQueue of a task, or None, i.e., the
+            task is not shared, and always yielded
+    """
+    deferred = list(tasks)
+    while len(deferred) > 0:
+        leased_elsewhere = []
+        for task in deferred:
+            leases = get_leases(task)
+            if leases is None:
+                yield task
+                continue
+            task_id = get_task_id(task)
+            if leases.claim(task_id):
+                yield task
+            elif not leases.is_done(task_id):
+                leased_elsewhere.append(task)
+        deferred = leased_elsewhere
+        if len(deferred) > 0:
+            time.sleep(poll)
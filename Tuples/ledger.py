@@ -0,0 +1,246 @@
+""" a SQLite run ledger, recording per book: the input hash, config hash, patterns hash,
+status, timings and output hash.
+
+pipeline.py processes exactly those books whose input, config or patterns changed since
+their last completed run (or whose output went missing), rather than checking for
+existing outputs only.
+
+Record outputs from before the ledger existed, as done wrt., the current configs:
+    python3 ledger.py adopt
+Summarise the ledger:
+    python3 ledger.py
+"""
+
+import hashlib
+import inspect
+import json
+import pathlib
+import sqlite3
+import sys
+import threading
+import time
+
+import registry
+from tuple_output import get_output_fp
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS books (
+    set_name TEXT NOT NULL,
+    stem TEXT NOT NULL,
+    input_stat TEXT,
+    input_hash TEXT,
+    config_hash TEXT,
+    patterns_hash TEXT,
+    status TEXT,
+    started REAL,
+    finished REAL,
+    seconds REAL,
+    output_hash TEXT,
+    PRIMARY KEY (set_name, stem)
+)
+"""
+
+
+class Ledger:
+    def __init__(self, db_fp: pathlib.Path):
+        """The ledger at db_fp (created if missing).
+
+        Note: usable from several threads of one process
+        """
+        self.db_fp = pathlib.Path(db_fp).expanduser().resolve()
+        self.db_fp.parent.mkdir(parents=True, exist_ok=True)
+        self.con = sqlite3.connect(self.db_fp, check_same_thread=False, timeout=60)
+        self.lock = threading.Lock()
+        with self.lock, self.con:
+            self.con.execute(SCHEMA)
+
+    def get_rows(self, set_name: str) -> dict[str, dict]:
+        """Return {stem: row::dict} wrt., set_name."""
+        with self.lock:
+            cursor = self.con.execute("SELECT * FROM books WHERE set_name = ?", (set_name,))
+            cols = [d[0] for d in cursor.description]
+            return {row[1]: dict(zip(cols, row)) for row in cursor.fetchall()}
+
+    def get_outstanding(
+        self,
+        set_name: str,
+        books: list,
+        config_hash: str,
+        patterns_hash: str,
+        output_dir: pathlib.Path,
+    ) -> list:
+        """Return the books needing (re)processing, i.e., those without a completed run
+        wrt., their current input, config_hash and patterns_hash, or without output.
+
+        Note: input hashes are only recomputed for books whose size/mtime changed
+        """
+        rows = self.get_rows(set_name)
+        outstanding = []
+        stat_updates = []
+        for book in books:
+            row = rows.get(book.stem)
+            input_stat = get_input_stat(book)
+
+            if row is None or row["status"] != "done":
+                outstanding.append(book)
+                continue
+
+            if row["input_stat"] != input_stat:
+                input_hash = get_input_hash(book)
+                if input_hash != row["input_hash"]:
+                    outstanding.append(book)
+                    continue
+                stat_updates.append((input_stat, set_name, book.stem))  # e.g., touched only
+
+            if (
+                row["config_hash"] != config_hash
+                or row["patterns_hash"] != patterns_hash
+                or not get_output_fp(output_dir, book.stem).exists()
+            ):
+                outstanding.append(book)
+
+        with self.lock, self.con:
+            self.con.executemany(
+                "UPDATE books SET input_stat = ? WHERE set_name = ? AND stem = ?", stat_updates
+            )
+        return outstanding
+
+    def start(self, set_name: str, books: list, config_hash: str, patterns_hash: str):
+        """Record books as running, wrt., their current inputs and the given hashes."""
+        now = time.time()
+        rows = [
+            (
+                set_name,
+                book.stem,
+                get_input_stat(book),
+                get_input_hash(book),
+                config_hash,
+                patterns_hash,
+                "running",
+                now,
+            )
+            for book in books
+        ]
+        with self.lock, self.con:
+            self.con.executemany(
+                """INSERT INTO books
+                    (set_name, stem, input_stat, input_hash, config_hash, patterns_hash, status, started)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (set_name, stem) DO UPDATE SET
+                    input_stat = excluded.input_stat,
+                    input_hash = excluded.input_hash,
+                    config_hash = excluded.config_hash,
+                    patterns_hash = excluded.patterns_hash,
+                    status = excluded.status,
+                    started = excluded.started,
+                    finished = NULL,
+                    seconds = NULL,
+                    output_hash = NULL""",
+                rows,
+            )
+
+    def finish(self, set_name: str, stem: str, seconds: float, output_hash: str):
+        """Record book stem as done."""
+        self.finish_many(set_name, [(stem, seconds, output_hash)])
+
+    def finish_many(self, set_name: str, finished: list[tuple]):
+        """Record books as done, given (stem, seconds, output_hash) tuples."""
+        now = time.time()
+        with self.lock, self.con:
+            self.con.executemany(
+                """UPDATE books SET status = 'done', finished = ?, seconds = ?, output_hash = ?
+                WHERE set_name = ? AND stem = ?""",
+                [(now, seconds, output_hash, set_name, stem) for stem, seconds, output_hash in finished],
+            )
+
+
+def get_input_stat(book) -> str:
+    """Return a cheap fingerprint of the book's input, i.e., size and mtime (or, for a
+    packed book, its location in the packed corpus)."""
+    if hasattr(book, "corpus"):  # i.e., a Loaders.shards.ShardBook
+        return json.dumps([str(book.corpus.corpus_dir)] + book.corpus.books[book.name])
+    else:
+        stat = book.stat()
+        return json.dumps([stat.st_size, stat.st_mtime_ns])
+
+
+def get_input_hash(book) -> str:
+    return hashlib.blake2b(book.read_bytes(), digest_size=16).hexdigest()
+
+
+def get_config_hash(config: dict) -> str:
+    """Return a hash of the config settings which determine a book's output, i.e., the
+    loader, dictionary (content), parser, patterns and matcher (source)."""
+    import tuple_fetcher
+
+    h = hashlib.blake2b(digest_size=16)
+    for key in ["loader", "parser", "patterns"]:
+        h.update(config[key].encode("utf-8"))
+    with open(pathlib.Path(config["dictionary_fp"]).expanduser().resolve(), "rb") as f:
+        h.update(f.read())
+    h.update(inspect.getsource(tuple_fetcher).encode("utf-8"))
+
+    # i.e., loader module VERSION, see Loaders/cache.py
+    module = sys.modules[registry.resolve("loader", config["loader"]).__module__]
+    h.update(str(getattr(module, "VERSION", 0)).encode("utf-8"))
+    return h.hexdigest()
+
+
+def get_patterns_hash(patterns) -> str:
+    """Return a hash of the pattern set, i.e., its patterns and tiers."""
+    return hashlib.blake2b(
+        repr((patterns.patterns, patterns.adj_tiers, patterns.verb_tiers)).encode("utf-8"),
+        digest_size=16,
+    ).hexdigest()
+
+
+def get_ledger(config: dict) -> Ledger:
+    return Ledger(pathlib.Path(config.get("ledger", "ledger.sqlite")))
+
+
+def main(args):
+
+    # load configs
+    with open("configs.json", "r") as f:
+        configs: list[dict] = json.loads(f.read())
+
+    import pipeline
+
+    for config in configs:
+        if config["switch"] == True:
+            ledger = get_ledger(config)
+            set_name = config["set"]
+
+            if args[:1] == ["adopt"]:
+                # record existing outputs as done wrt., the current config
+                output_dir = pathlib.Path(config["output_dir"]).expanduser().resolve()
+                recorded = ledger.get_rows(set_name)
+                books = [
+                    book
+                    for book in pipeline.gen_input(config)
+                    if get_output_fp(output_dir, book.stem).exists() and book.stem not in recorded
+                ]
+                config_hash = get_config_hash(config)
+                patterns_hash = get_patterns_hash(pipeline.load_patterns(config))
+                ledger.start(set_name, books, config_hash, patterns_hash)
+                finished = []
+                for book in books:
+                    with open(get_output_fp(output_dir, book.stem), "rb") as f:
+                        output_hash = hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+                    finished.append((book.stem, None, output_hash))
+                ledger.finish_many(set_name, finished)
+                print(f"{set_name}: adopted {len(books)} existing outputs")
+
+            else:
+                rows = ledger.get_rows(set_name).values()
+                statuses = {}
+                for row in rows:
+                    statuses[row["status"]] = statuses.get(row["status"], 0) + 1
+                seconds = [row["seconds"] for row in rows if row["seconds"] is not None]
+                print(f"{set_name}: {statuses}")
+                if seconds:
+                    print(f"\t{sum(seconds):.0f}s processing over {len(seconds)} timed books")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
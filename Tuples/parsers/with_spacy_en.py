@@ -6,17 +6,25 @@ via spaCy for english text
 import pathlib
 import typing
 from collections import defaultdict
+from functools import lru_cache
 from itertools import cycle
 from pprint import pprint as pp
 
 import orjson
 import pandas as pd
-import spacy
 
-nlp = spacy.load("en_core_web_lg")
+# Note: texts are sliced lazily from the loader's (start, end) spans, as the parser consumes them
+from Loaders.PG_book import gen_texts
+
+@lru_cache(maxsize=None)
+def get_nlp():
+    """Return the spaCy pipeline, loading it (and spaCy) on first use only."""
+    import spacy
+
+    return spacy.load("en_core_web_lg")
 
 def parse_df(df: pd.DataFrame) -> list[tuple[dict, dict]]:
-    return parse_list(nlp.pipe(list(df["text"]), n_process=1))
+    return parse_list(get_nlp().pipe(gen_texts(df), n_process=1))
 
 def parse_list(docs) -> list[tuple[dict, dict]]:
     """Return a list of (structure::dict, properties::dict) tuples, one tuple for each text in texts."""
@@ -1,146 +1,675 @@
+import hashlib
 import itertools
 import json
+import multiprocessing as mp
 import pathlib
 import re
 import sys
+import threading
+import time
+import traceback
 import typing
+from collections import Counter, defaultdict
 from functools import partial
 from itertools import cycle, product
+from math import ceil
 from pprint import pprint as pp
-import numpy as np
-from multiprocessing import Pool
 
 from tqdm import tqdm
 # from tqdm.contrib.concurrent import process_map
 
-# import .py files in ./loaders
-for p in pathlib.Path("Loaders").glob("*.py"):
-    exec(f"import Loaders.{p.stem}")
+import Loaders.cache
+import Loaders.shards
+
+# Note: the loader, parser and patterns selected by a config are imported on demand
+import checkpoints
+import registry
+from dedup import get_dropped
+from leases import LeaseQueue, gen_claimed
+from ledger import get_config_hash, get_ledger, get_patterns_hash
+from stages import Stages
+from telemetry import get_peak_rss_mb, get_telemetry
+from tuple_fetcher import get_tuples
+from tuple_output import TupleWriter, get_output_fp
 
-# import .py files in ./parsers
-for p in pathlib.Path("parsers").glob("*.py"):
-    exec(f"import parsers.{p.stem}")
+# books larger than this are split into paragraph-range chunks, processed in parallel
+CHUNK_BYTES = 2**22
 
-# load the classes containing patterns
-for p in pathlib.Path("patterns").glob("*.py"):
-    exec(f"import patterns.{p.stem}")
+# default bound on the number of items queued at each stage, see get_worker_stages
+PREFETCH = 2
 
-from tuple_fetcher import get_tuples
+# seconds without a heartbeat, after which a lease (see leases.py) expires
+LEASE_TTL = 300
+
+# seconds between checks on whether the worker processes are alive
+WORKER_POLL = 1
 
-def main(args):
+def main():
 
     # load configs
     with open("configs.json", "r") as f:
         configs: list[dict] = json.loads(f.read())
 
-    # iterate over the configs
+    # iterate over the configs, collecting the outstanding books of each
+    jobs = []
     for config_i, config in enumerate(configs, start=1):
-        print(f"runnng {config_i} of {len(configs)}")
+        print(f"preparing {config_i} of {len(configs)}")
 
         # run config if switched on
         if config["switch"] == True:
 
             ### 1. create a list of outstanding books to be processed
 
-            # create iterable of input files
-            input_dir = pathlib.Path(config["input"][0]).expanduser().resolve()
-            input_pattern = re.compile(config["input"][1])
-            fps: list[pathlib.Path] = list(gen_dir(input_dir, pattern=input_pattern))
+            # Note: input_dir may be a dir of books, or a packed corpus (see Loaders/shards.py)
+            books: list = list(gen_input(config))
 
-            # ignore input files with results
             output_dir = pathlib.Path(config["output_dir"]).expanduser().resolve()
             output_dir.mkdir(exist_ok=True, parents=True)
-            fps:list[str] = [str(fp) for fp in fps if (output_dir / f"{fp.stem}.json").exists() == False]
 
-            print(f'number of outstanding files to retrieve={len(fps)}')
+            # ignore near-duplicate books, as identified by dedup.py (if run)
+            dropped = get_dropped(config)
+            books = [book for book in books if book.stem not in dropped]
 
-            # ensure 'fps_lists' exist
-            fps_lists_dir = pathlib.Path("fps_lists").expanduser().resolve()
-            fps_lists_dir.mkdir(parents=True, exist_ok=True)
+            # ignore books already processed wrt., their current input and settings
+            ledger = get_ledger(config)
+            config_hash = get_config_hash(config)
+            patterns_hash = get_patterns_hash(load_patterns(config))
+            books = ledger.get_outstanding(
+                config["set"], books, config_hash, patterns_hash, output_dir
+            )
 
-            ### 2. Make sub-lists of outstanding books fps, one for each of n_processes
+            print(f'{config["set"]}: number of outstanding files to retrieve={len(books)}')
 
-            ## Check if we have all the lists we need already saved
-            n_processes = int(config['n_processes'])
-            name = config['set']
-            fps_lists_fps = [fps_lists_dir / f'{name}_{config_i}_{i}.json' for i in range(1, n_processes+1)]
+            ledger.start(config["set"], books, config_hash, patterns_hash)
+            jobs.append((config, [str(book) for book in books], ledger))
 
-            if all([fp.exists() for fp in fps_lists_fps]):
-                pass
-            else:
+    print(f"startup: {registry.format_timings(registry.TIMINGS)}")
 
-                ## otherwise re-build the lists and save them
-                chunks = [list(chunk) for chunk in np.array_split(fps, n_processes)]
-                for chunk, fp in zip(chunks, fps_lists_fps):
-                    with open(fp, 'w') as f:
-                        json.dump(chunk, f)
+    ### 2. Run the pipeline over the outstanding books of all switched-on configs at once
 
-            ### 3. Run the pipeline wrt., the current process
+    pipeline(jobs)
 
-            if n_processes == 1:
-                pipeline(config, fps_lists_dir / f'{name}_{config_i}_1.json')
-            else:
-                num = int(args[0])
-                pipeline(config, fps_lists_dir / f'{name}_{config_i}_{num}.json')
 
-def pipeline(config: dict, fps_list_fp:pathlib.Path):
+def gen_input(config: dict) -> typing.Generator:
+    """Return a generator of the input books wrt., config."""
+    input_dir = pathlib.Path(config["input"][0]).expanduser().resolve()
+    input_pattern = re.compile(config["input"][1])
+    return Loaders.shards.gen_books(input_dir, pattern=input_pattern)
+
 
-    parser: typing.Callable = eval(config["parser"])
+def load_patterns(config: dict):
+    """Return the patterns object wrt., config."""
+    return registry.resolve("patterns", config["patterns"])()
 
-    patterns = eval(config["patterns"])()
 
-    # the loader does the work, it returns
-    loader = eval(config["loader"])
+def pipeline(jobs: list[tuple]):
+    """Process the books of each (config, fps, ledger) job, in one pool of worker processes
+    shared by all jobs, i.e., the max config["n_processes"] over jobs, each worker loading
+    the parser model once.
 
-    output_dir = pathlib.Path(config["output_dir"]).expanduser().resolve()
+    Note: tasks (of all jobs) are dispatched one at a time, largest first, from a shared
+    task queue, i.e., idle workers pull the next outstanding task of any job
+    Note: within each worker, loading, parsing and matching run as overlapping stages
+    (see get_worker_stages), and results are saved by a writer thread in this process,
+    to the output_dir of the task's config
+    Note: books larger than config["chunk_bytes"] are split into several tasks, each a
+    range of paragraphs, whose results are merged (in order) before saving
+    Note: saved books are recorded as done in the job's ledger, if not None
+    Note: with config["lease_dir"], the config's tasks are shared with any other
+    pipeline.py processes using the same lease_dir (see leases.py)
+    """
 
-    # get dict used by loader for handling cut words
-    with open(
-        pathlib.Path(config["dictionary_fp"]).expanduser().resolve(),
-        "r",
-        encoding="utf-8",
-    ) as f:
-        dictionary: set[str] = set([w.strip("\n") for w in f.readlines()])
+    # set -> the per job state
+    sets = {}
+    for config, fps, ledger in jobs:
+        if config["set"] in sets:
+            raise ValueError(f"switched-on configs share the set name {config['set']}")
+        sets[config["set"]] = {
+            "config": config,
+            "fps": fps,
+            "ledger": ledger,
+            "output_dir": pathlib.Path(config["output_dir"]).expanduser().resolve(),
+            # i.e., the (config, patterns) hashes, keying the checkpoints of its books
+            "hashes": (get_config_hash(config), get_patterns_hash(load_patterns(config))),
+            # optionally, share tasks with other pipeline.py processes (on any host), via leases
+            "leases": get_leases(config),
+            # fp -> processing seconds, summed over the chunks processed in this run
+            "seconds": defaultdict(float),
+            # fps saved by this process
+            "saved": set(),
+            # per task metrics, see telemetry.py
+            "telemetry": get_telemetry(config),
+        }
+
+    def finish(job: dict, fp: str, stem: str, output_hash: str):
+        job["saved"].add(fp)
+        if job["ledger"] is not None:
+            job["ledger"].finish(
+                job["config"]["set"], stem, job["seconds"].pop(fp, None), output_hash
+            )
+
+    def merge(job: dict, fp: str, n_chunks: int) -> bool:
+        """Save book fp from its checkpointed chunks, and remove its checkpoints.
+        Return False if another process (holding the merge lease) does so instead."""
+        book = Loaders.shards.resolve(fp)
+        stem = book.stem
+        output_dir, leases = job["output_dir"], job["leases"]
+        merge_id = f"{stem}.{checkpoints.get_book_key(book, *job['hashes'])}.merge"
+        if leases is not None and not leases.claim(merge_id):
+            return False
+        partial_dir = checkpoints.get_partial_dir(output_dir, book, *job["hashes"])
+        chunks = [
+            checkpoints.load_checkpoint(partial_dir, chunk_i, n_chunks)
+            for chunk_i in range(n_chunks)
+        ]
+        output_hash = save_tuples(output_dir, fp, chunks)
+        checkpoints.remove_checkpoints(output_dir, stem)
+        if leases is not None:
+            leases.complete(merge_id)
+        finish(job, fp, stem, output_hash)
+        return True
+
+    def reopen_lost(job: dict, book, n_chunks: int, done: set):
+        """Reopen the lease tasks of book marked done, whose results are lost, i.e., the
+        book has no output, and the chunk no checkpoint (e.g., the output was deleted, or
+        removed as truncated by checkpoints.py), s.t., the book is re-claimed."""
+        if get_output_fp(job["output_dir"], book.stem).exists():
+            return
+        key = checkpoints.get_book_key(book, *job["hashes"])
+        job["leases"].reopen(f"{book.stem}.{key}.merge")
+        for chunk_i in set(range(n_chunks)) - done:
+            job["leases"].reopen(f"{book.stem}.{key}.{chunk_i}_{n_chunks}")
+
+    # build (set, fp, chunk_i, n_chunks) tasks, largest first
+    # Note: chunks checkpointed by a previous (interrupted) run are skipped
+    tasks = []
+    n_resumed = 0
+    for set_name, job in sets.items():
+        chunk_bytes = int(job["config"].get("chunk_bytes", CHUNK_BYTES))
+        for fp in job["fps"]:
+            book = Loaders.shards.resolve(fp)
+            size = get_size(book)
+            n_chunks = max(1, ceil(size / chunk_bytes))
+            done = (
+                checkpoints.get_checkpointed(
+                    checkpoints.get_partial_dir(job["output_dir"], book, *job["hashes"]), n_chunks
+                )
+                if n_chunks > 1
+                else set()
+            )
+            if job["leases"] is not None:
+                reopen_lost(job, book, n_chunks, done)
+            if len(done) == n_chunks:
+                merge(job, fp, n_chunks)
+                continue
+            n_resumed += len(done) > 0
+            tasks += [
+                (size / n_chunks, (set_name, fp, chunk_i, n_chunks))
+                for chunk_i in range(n_chunks)
+                if chunk_i not in done
+            ]
+    tasks = [task for _, task in sorted(tasks, key=lambda x: x[0], reverse=True)]
+    if n_resumed > 0:
+        print(f"resuming {n_resumed} partially processed books from checkpoints")
+
+    def write(result: tuple) -> typing.Union[tuple, None]:
+        """Save a single chunk book, or checkpoint a chunk result, saving the book once
+        all of its chunks are checkpointed (by this, or any other, process)."""
+        set_name, fp, chunk_i, n_chunks, rows, stats = result
+        job = sets[set_name]
+        book = Loaders.shards.resolve(fp)
+        stem = book.stem
+        start = time.perf_counter()
+        job["seconds"][fp] += sum(stats["seconds"].values())
+
+        if n_chunks == 1:
+            output_hash = save_tuples(job["output_dir"], fp, [rows])
+            finish(job, fp, stem, output_hash)
+            saved = (set_name, fp)
+        else:
+            # Note: checkpointed chunks are reloaded from disk at merge, rather than held
+            partial_dir = checkpoints.get_partial_dir(job["output_dir"], book, *job["hashes"])
+            checkpoints.save_checkpoint(partial_dir, chunk_i, n_chunks, rows)
+            done = checkpoints.get_checkpointed(partial_dir, n_chunks)
+            saved = (set_name, fp) if len(done) == n_chunks and merge(job, fp, n_chunks) else None
+
+        if job["leases"] is not None:
+            job["leases"].complete(get_task_id((set_name, fp, chunk_i, n_chunks), job["hashes"]))
+
+        stats["seconds"]["write"] = time.perf_counter() - start
+        job["telemetry"].record(
+            {
+                "set": set_name,
+                "book": stem,
+                "chunk_i": chunk_i,
+                "n_chunks": n_chunks,
+                **stats,
+                "time": time.time(),
+            }
+        )
+        return saved
+
+    # the tasks this process works on
+    for job in sets.values():
+        if job["leases"] is not None:
+            job["leases"].start_heartbeat()
+    source = gen_claimed(
+        tasks, lambda task: sets[task[0]]["leases"], lambda task: get_task_id(task, sets[task[0]]["hashes"])
+    )
+
+    # the shared pool, i.e., sized wrt., the most demanding config
+    configs = [job["config"] for job in sets.values()]
+    pool = {
+        key: max([int(config.get(key, default)) for config in configs], default=default)
+        for key, default in [("n_processes", 1), ("prefetch", PREFETCH), ("n_matchers", 1)]
+    }
+    n_processes = pool["n_processes"]
+    maxsize = pool["prefetch"]
+    with tqdm(total=len(set((set_name, fp) for set_name, fp, _, _ in tasks))) as progress:
+
+        if n_processes == 1:
+            # i.e., all stages in this process
+            n_timings = len(registry.TIMINGS)
+            init_worker(configs)
+            tqdm.write(f"worker startup: {registry.format_timings(registry.TIMINGS[n_timings:])}")
+            # Note: i.e., matching does not run in parallel with parsing here
+            stages = get_worker_stages(source, pool)
+            stages.add("match", match_chunk)
+            stages.add("write", write, maxsize=maxsize)
+            for saved in stages:
+                progress.update(1)
+                progress.set_postfix(stages.depths())
+
+        else:
+            # workers pull tasks from a shared queue, load and parse them, and pass the
+            # parses to their own pool["n_matchers"] matcher processes, which return chunk
+            # results to this process, which saves them in a writer thread
+            # Note: the task queue is fed just-in-time (in a thread), s.t., leases are
+            # claimed only as workers become free
+            task_queue = mp.Queue(maxsize=n_processes)
+
+            def feed():
+                for task in source:
+                    task_queue.put(task)
+                for _ in range(n_processes):
+                    task_queue.put(None)  # i.e., one end marker per worker
+
+            threading.Thread(target=feed, daemon=True).start()
+            result_queue = mp.Queue(maxsize=n_processes * maxsize)
+
+            # i.e., (name, process), where a process puts (proc_i, kind, value) messages
+            # onto result_queue, see run_worker and run_matcher
+            procs = []
+            for worker_i in range(n_processes):
+                match_queue = mp.Queue(maxsize=maxsize)
+                procs.append(
+                    (
+                        f"worker {worker_i}",
+                        mp.Process(
+                            target=run_worker,
+                            args=(configs, pool, task_queue, match_queue, result_queue, len(procs), worker_i),
+                            daemon=True,
+                        ),
+                    )
+                )
+                for matcher_i in range(pool["n_matchers"]):
+                    procs.append(
+                        (
+                            f"matcher {worker_i}.{matcher_i}",
+                            mp.Process(
+                                target=run_matcher,
+                                args=(configs, match_queue, result_queue, len(procs)),
+                                daemon=True,
+                            ),
+                        )
+                    )
+            for _, proc in procs:
+                proc.start()
+
+            # i.e., puts (proc_i, "exit", exitcode) as each process exits, after any
+            # results it put (which are flushed before a process exits), s.t., a process
+            # exiting without an end marker (e.g., killed by the OS) is detected
+            finished = threading.Event()
+
+            def monitor():
+                exited = set()
+                while len(exited) < len(procs) and not finished.is_set():
+                    for proc_i, (_, proc) in enumerate(procs):
+                        if proc_i not in exited and proc.exitcode is not None:
+                            exited.add(proc_i)
+                            result_queue.put((proc_i, "exit", proc.exitcode))
+                    time.sleep(WORKER_POLL)
+
+            threading.Thread(target=monitor, daemon=True).start()
+
+            worker_depths = {}  # proc_i -> latest reported stage depths, of each worker
+            matching = [0]  # i.e., chunks parsed, but not yet matched
+
+            def gen_results() -> typing.Generator:
+                running = set(range(len(procs)))
+                while running:
+                    proc_i, kind, value = result_queue.get()
+                    name = procs[proc_i][0]
+                    if kind == "error":
+                        raise RuntimeError(f"{name} failed:\n{value}")
+                    elif kind == "exit":
+                        if proc_i in running:
+                            raise RuntimeError(
+                                f"{name} exited (exitcode {value}) without finishing, "
+                                "e.g., killed by the OS; rerun to resume the outstanding books"
+                            )
+                    elif kind == "startup":
+                        tqdm.write(f"{name} startup: {registry.format_timings(value)}")
+                    elif kind == "parsed":
+                        worker_depths[proc_i] = value
+                        matching[0] += 1
+                    elif kind == "end":
+                        running.remove(proc_i)
+                    else:  # i.e., "result"
+                        matching[0] -= 1
+                        yield value
+                finished.set()
+
+            stages = Stages(gen_results(), maxsize=maxsize).add("write", write)
+            try:
+                for saved in stages:
+                    progress.update(1)
+                    progress.set_postfix(get_total_depths(worker_depths, matching[0], stages.depths()))
+            except BaseException:
+                # i.e., fail fast, rather than wait on the remaining processes
+                finished.set()
+                task_queue.cancel_join_thread()
+                for _, proc in procs:
+                    proc.terminate()
+                raise
+
+            for _, proc in procs:
+                proc.join()
+
+    for set_name, job in sets.items():
+        if job["leases"] is not None:
+            job["leases"].stop()
+
+            # record books saved by other processes
+            if job["ledger"] is not None:
+                for fp in set(fp for s, fp, _, _ in tasks if s == set_name) - job["saved"]:
+                    stem = Loaders.shards.resolve(fp).stem
+                    output_fp = get_output_fp(job["output_dir"], stem)
+                    if output_fp.exists():
+                        with open(output_fp, "rb") as f:
+                            output_hash = hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+                        job["ledger"].finish(set_name, stem, None, output_hash)
+
+
+def get_leases(config: dict) -> typing.Union[LeaseQueue, None]:
+    """Return the LeaseQueue wrt., config["lease_dir"] (if any).
+
+    Note: leases are namespaced by set, config and patterns, s.t., done markers of a
+    previous campaign with different settings are not reused
+    """
+    if not config.get("lease_dir"):
+        return None
+    namespace = f"{config['set']}-{get_config_hash(config)[:8]}-{get_patterns_hash(load_patterns(config))[:8]}"
+    return LeaseQueue(
+        pathlib.Path(config["lease_dir"]) / namespace,
+        ttl=float(config.get("lease_ttl", LEASE_TTL)),
+    )
+
+
+def get_task_id(task: tuple, hashes: tuple) -> str:
+    """Return e.g., '1234.<key>.0_3', i.e., unique within the set's lease namespace, where
+    key is as per the book's checkpoints (see checkpoints.get_book_key), s.t., done markers
+    of a previous input of the book are not reused"""
+    _, fp, chunk_i, n_chunks = task
+    book = Loaders.shards.resolve(fp)
+    return f"{book.stem}.{checkpoints.get_book_key(book, *hashes)}.{chunk_i}_{n_chunks}"
+
+
+def run_worker(
+    configs: list[dict],
+    pool: dict,
+    task_queue: mp.Queue,
+    match_queue: mp.Queue,
+    result_queue: mp.Queue,
+    proc_i: int,
+    worker_i: int,
+):
+    """Run the load and parse stages over tasks pulled from task_queue, putting each
+    parsed chunk onto match_queue (see run_matcher), and (proc_i, "parsed", stage depths)
+    onto result_queue, then an end marker per matcher, and (proc_i, "end", None).
+
+    Note: (proc_i, "startup", import and model load timings) is put first
+    """
+    try:
+        n_timings = len(registry.TIMINGS)  # i.e., excluding any inherited on fork
+        init_worker(configs, worker_i=worker_i)
+        result_queue.put((proc_i, "startup", registry.TIMINGS[n_timings:]))
+        stages = get_worker_stages(iter(task_queue.get, None), pool)
+        for parsed in stages:
+            result_queue.put((proc_i, "parsed", stages.depths()))
+            match_queue.put(parsed)
+        for _ in range(pool["n_matchers"]):
+            match_queue.put(None)
+        result_queue.put((proc_i, "end", None))
+    except BaseException:
+        result_queue.put((proc_i, "error", traceback.format_exc()))
+
+
+def run_matcher(configs: list[dict], match_queue: mp.Queue, result_queue: mp.Queue, proc_i: int):
+    """Match the parsed chunks pulled from match_queue, putting (proc_i, "result", result)
+    onto result_queue, then (proc_i, "end", None).
+
+    Note: i.e., matching (pure Python) runs in its own process, in parallel with the
+    parser, rather than contending with it for the GIL
+    Note: (proc_i, "startup", import timings) is put first
+    """
+    try:
+        n_timings = len(registry.TIMINGS)
+        init_matcher(configs)
+        result_queue.put((proc_i, "startup", registry.TIMINGS[n_timings:]))
+        for parsed in iter(match_queue.get, None):
+            result_queue.put((proc_i, "result", match_chunk(parsed)))
+        result_queue.put((proc_i, "end", None))
+    except BaseException:
+        result_queue.put((proc_i, "error", traceback.format_exc()))
+
+
+def get_worker_stages(tasks: typing.Iterable, pool: dict) -> Stages:
+    """Return the load -> parse stages wrt., tasks.
+
+    Note: loading prefetches up to pool["prefetch"] chunks ahead of the parser, s.t., the
+    parser does not wait on it
+    """
+    stages = Stages(tasks, maxsize=pool["prefetch"])
+    stages.add("load", load_chunk)
+    stages.add("parse", parse_chunk)
+    return stages
+
+
+def get_total_depths(worker_depths: dict, n_matching: int, writer_depths: dict) -> dict:
+    """Return stage depths summed over workers, the chunks parsed but not yet matched,
+    plus the writer depths."""
+    total = defaultdict(int)
+    for depths in worker_depths.values():
+        for name, depth in depths.items():
+            if name != "out":
+                total[name] += depth
+    total["match"] = n_matching
+    total["write"] = writer_depths["write"]
+    return dict(total)
+
+
+def save_tuples(output_dir: pathlib.Path, fp: str, chunks: list[list]) -> str:
+    """Save the rows of book fp, given the rows of each of its chunks in order, one row
+    group per chunk (see tuple_output.py). Return the output hash.
+    """
+    stem = Loaders.shards.resolve(fp).stem
+    with TupleWriter(get_output_fp(output_dir, stem), stem) as writer:
+        for rows in chunks:
+            writer.add(rows)
+    return writer.output_hash
 
-    # load the list of book filepaths to consider in this process
-    with open(fps_list_fp, 'r') as f:
-        fps:list[pathlib.Path] = [pathlib.Path(fp) for fp in json.load(f)]
-    
-    for fp in tqdm(fps):
 
-        print(fp.stem)
+def get_size(fp) -> int:
+    """Return the size of book fp, in bytes."""
+    if isinstance(fp, Loaders.shards.ShardBook):
+        return fp.size
+    else:
+        return fp.stat().st_size
 
-        # get sentence parts for fp
-        df = loader(fp, dictionary)
 
-        # get parses wrt., df
-        parses: list[tuple] = parser(df)
+# per worker state, see init_worker
+_worker = {}
 
-        # ------
-        # get the tuples from the parses
-        # ------
-        adj_tiers = patterns.adj_tiers
-        verb_tiers = patterns.verb_tiers
-        # where pattern_tiers[i] is a list of patterns
-        # where pattern_tiers[i][j] is a tuple, corresponding to a pattern,
-        #   of (pattern_s::dict, pattern_p, pattern_t::list[tuple])
 
-        # get tuples for df
-        tuples = []
-        for text, (parse_s, parse_p) in tqdm(zip(df['text'], parses)):
-            found_tuples = list(set(get_tuples(parse_s, parse_p, adj_tiers)))  # adj
-            # Note: list(set ... ensures unique tuple instances by text
-            if len(found_tuples) > 0:
-                tuples += (text, found_tuples)
-        for text, (parse_s, parse_p) in tqdm(zip(df['text'], parses)):
-            found_tuples = list(set(get_tuples(parse_s, parse_p, verb_tiers)))  # verbs
-            # Note: list(set ... ensures unique tuple instances by text
-            if len(found_tuples) > 0:
-                tuples += (text, found_tuples)
+def init_worker(configs: list[dict], *, worker_i: int = 0):
+    """Load the loader, parser (and its model), patterns and dictionary wrt., each config,
+    once per worker.
 
-        # # save tuples for doc
-        with open(output_dir / f"{fp.stem}.json", "w", encoding="utf-8") as f:
-            json.dump(tuples, f)
+    Note: i.e., _worker["sets"][set] holds the state wrt., each config, where configs
+    selecting the same parser (or dictionary) share one instance
+    """
+
+    _worker["worker_i"] = worker_i
+    _worker["sets"] = {}
+    dictionaries = {}
+
+    for config in configs:
+        state = {}
+
+        state["output_dir"] = pathlib.Path(config["output_dir"]).expanduser().resolve()
+
+        state["parser"] = registry.resolve("parser", config["parser"], load=True)
+
+        state["patterns"] = load_patterns(config)
+
+        # i.e., keying the checkpoints (and shared loader output) of multi-chunk books
+        state["hashes"] = (get_config_hash(config), get_patterns_hash(state["patterns"]))
+
+        # the loader does the work, it returns
+        loader = registry.resolve("loader", config["loader"])
+
+        # get dict used by loader for handling cut words
+        dictionary_fp = pathlib.Path(config["dictionary_fp"]).expanduser().resolve()
+        if dictionary_fp not in dictionaries:
+            with open(dictionary_fp, "r", encoding="utf-8") as f:
+                dictionaries[dictionary_fp] = set([w.strip("\n") for w in f.readlines()])
+        state["dictionary"] = dictionaries[dictionary_fp]
+
+        # optionally, serve loader outputs from a cache of preprocessed books
+        if config.get("cache_dir"):
+            loader = Loaders.cache.CachedLoader(
+                loader, config["cache_dir"], config["dictionary_fp"]
+            )
+        state["loader"] = loader
+
+        _worker["sets"][config["set"]] = state
+
+
+def init_matcher(configs: list[dict]):
+    """Load the patterns wrt., each config, once per matcher process."""
+    _worker["sets"] = {config["set"]: {"patterns": load_patterns(config)} for config in configs}
+
+
+def load_chunk(task: tuple) -> tuple:
+    """Return (task, df, stats) where df holds the sentence parts of the task's chunk,
+    i.e., paragraphs [P*chunk_i/n_chunks, P*(chunk_i+1)/n_chunks) of the P paragraph book.
+    """
+    set_name, fp, chunk_i, n_chunks = task
+    state = _worker["sets"][set_name]
+    book = Loaders.shards.resolve(fp)
+    start = time.perf_counter()
+
+    # get sentence parts for fp
+    # Note: a multi-chunk book is loaded (i.e., cleaned and segmented) once, by the first
+    # of its chunk tasks to arrive, and shared with the others via its partial dir
+    if n_chunks > 1:
+        partial_dir = checkpoints.get_partial_dir(state["output_dir"], book, *state["hashes"])
+        df = checkpoints.get_loaded(partial_dir, lambda: state["loader"](book, state["dictionary"]))
+    else:
+        df = state["loader"](book, state["dictionary"])
+
+    # restrict to the chunk's paragraphs
+    paragraph_is = df["label"].map(get_paragraph_i)
+    if n_chunks > 1:
+        n_paragraphs = paragraph_is.max() + 1 if len(df) > 0 else 0
+        lo = n_paragraphs * chunk_i // n_chunks
+        hi = n_paragraphs * (chunk_i + 1) // n_chunks
+        attrs = df.attrs
+        in_chunk = (paragraph_is >= lo) & (paragraph_is < hi)
+        df = df[in_chunk]
+        df.attrs = attrs
+        paragraph_is = paragraph_is[in_chunk]
+
+    # Note: see telemetry.py
+    stats = {
+        "worker": _worker["worker_i"],
+        "bytes": get_size(book),
+        "paragraphs": int(paragraph_is.nunique()),
+        "parts": len(df),
+        "seconds": {"load": time.perf_counter() - start},
+    }
+    return task, df, stats
+
+
+def parse_chunk(loaded: tuple) -> tuple:
+    """Return (task, parts, parses, stats) wrt., the loaded chunk, where parts holds the
+    (paragraph_i, part_i, start, end) of each text."""
+    task, df, stats = loaded
+    start = time.perf_counter()
+
+    # get parses wrt., df
+    parses: list[tuple] = _worker["sets"][task[0]]["parser"](df)
+
+    # Note: each text is recorded as its [start, end) span in the loader's cleaned book body
+    parts = [
+        (int(get_paragraph_i(label)), int(get_part_i(label)), int(start), int(end))
+        for label, start, end in zip(df["label"], df["start"], df["end"])
+    ]
+
+    stats["tokens"] = sum(len(parse_p) for _, parse_p in parses)
+    stats["peak_rss_mb"] = get_peak_rss_mb()  # i.e., of the parsing worker
+    stats["seconds"]["parse"] = time.perf_counter() - start
+    return task, parts, parses, stats
+
+
+def match_chunk(parsed: tuple) -> tuple:
+    """Return (set, fp, chunk_i, n_chunks, rows, stats) wrt., the parsed chunk, where rows
+    holds (paragraph_i, part_i, noun, feature, role, pattern, start, end) tuples."""
+    (set_name, fp, chunk_i, n_chunks), parts, parses, stats = parsed
+    start = time.perf_counter()
+
+    # ------
+    # get the tuples from the parses
+    # ------
+    adj_tiers = _worker["sets"][set_name]["patterns"].adj_tiers
+    verb_tiers = _worker["sets"][set_name]["patterns"].verb_tiers
+    # where pattern_tiers[i] is a list of patterns
+    # where pattern_tiers[i][j] is a tuple, corresponding to a pattern,
+    #   of (pattern_s::dict, pattern_p, pattern_t::list[tuple])
+
+    # get tuples for df, i.e., in text order, adj then verb tuples per text
+    rows = []
+    for (paragraph_i, part_i, start_, end), (parse_s, parse_p) in zip(parts, parses):
+        for tiers in [adj_tiers, verb_tiers]:
+            found_tuples = sorted(set(get_tuples(parse_s, parse_p, tiers)))
+            # Note: sorted(set ... ensures unique tuple instances by text, in a stable order
+            for noun, feature, role, pattern in found_tuples:
+                rows.append((paragraph_i, part_i, noun, feature, role, pattern, start_, end))
+
+    stats["tuples"] = dict(Counter(row[4] for row in rows))
+    stats["seconds"]["match"] = time.perf_counter() - start
+    return set_name, fp, chunk_i, n_chunks, rows, stats
+
+
+def get_paragraph_i(label) -> int:
+    """Return the paragraph index of a loader label, i.e., paragraph_i or [paragraph_i, ...]"""
+    return label[0] if isinstance(label, (list, tuple)) else label
+
+
+def get_part_i(label) -> int:
+    """Return the part (or sentence) index of a loader label, i.e., -1 wrt., paragraph_i"""
+    return label[1] if isinstance(label, (list, tuple)) else -1
 
 
 def gen_dir(
@@ -184,4 +713,4 @@ def gen_chunks(iterable: typing.Iterable, chunk_size: int) -> typing.Generator:
 
 
 if __name__ == "__main__":
-    main(sys.argv[1:])
+    main()
@@ -0,0 +1,79 @@
+""" a lazy registry of the loaders, parsers and pattern sets selectable in configs.json
+
+Nothing is imported until a config selects it, and parser models (e.g., spaCy's
+en_core_web_lg) are only loaded by processes which parse, i.e., not by the main
+process, dedup.py, ledger.py, etc.
+
+A config string not registered below is resolved as a dotted path, e.g.,
+"Loaders.PG_book.as_parts" -> attr as_parts of module Loaders.PG_book
+"""
+
+import importlib
+import time
+import typing
+from contextlib import contextmanager
+
+# kind -> {config string -> (module, attr, model loader attr or None)}
+REGISTRY = {
+    "loader": {
+        "Loaders.PG_book.as_parts": ("Loaders.PG_book", "as_parts", None),
+        "Loaders.PG_book.as_sentences": ("Loaders.PG_book", "as_sentences", None),
+        "Loaders.PG_book.as_paragraphs": ("Loaders.PG_book", "as_paragraphs", None),
+    },
+    "parser": {
+        "parsers.with_spacy_en.parse_df": ("parsers.with_spacy_en", "parse_df", "get_nlp"),
+    },
+    "patterns": {
+        "patterns.for_spacy_en.Patterns": ("patterns.for_spacy_en", "Patterns", None),
+    },
+}
+
+# (label, seconds) of each import or model load in this process
+TIMINGS: list[tuple[str, float]] = []
+
+_resolved: dict = {}
+
+
+@contextmanager
+def timed(label: str):
+    start = time.perf_counter()
+    yield
+    TIMINGS.append((label, time.perf_counter() - start))
+
+
+def get_target(kind: str, name: str) -> tuple:
+    """Return the (module, attr, model loader attr or None) registered wrt., kind and name."""
+    if name in REGISTRY[kind]:
+        return REGISTRY[kind][name]
+    module_name, attr = name.rsplit(".", 1)
+    return module_name, attr, None
+
+
+def resolve(kind: str, name: str, *, load: bool = False) -> typing.Any:
+    """Return the kind (i.e., "loader", "parser" or "patterns") object selected by name,
+    importing its module on first use.
+
+    Args:
+        load (bool): also load the object's model (if any), e.g., before parsing
+    """
+    module_name, attr, model_attr = get_target(kind, name)
+
+    if (kind, name) not in _resolved:
+        with timed(f"import {module_name}"):
+            module = importlib.import_module(module_name)
+        _resolved[(kind, name)] = getattr(module, attr)
+
+    if load and model_attr is not None:
+        module = importlib.import_module(module_name)
+        if (kind, name, "model") not in _resolved:
+            with timed(f"load {module_name}.{model_attr}()"):
+                getattr(module, model_attr)()
+            _resolved[(kind, name, "model")] = True
+
+    return _resolved[(kind, name)]
+
+
+def format_timings(timings: list[tuple[str, float]]) -> str:
+    """Return e.g., '3.2s (import parsers.with_spacy_en 1.1s, load ... 2.1s)'"""
+    total = sum(seconds for _, seconds in timings)
+    return f"{total:.1f}s (" + ", ".join(f"{label} {seconds:.1f}s" for label, seconds in timings) + ")"
@@ -0,0 +1,334 @@
+""" a fast, stratified sampling mode for pattern development
+
+For each switched-on config, draws a reproducible sample of books, stratified by LoCC,
+author era (i.e., the first author's birth year, by 50 years) and book length (quartile
+of bytes), then a sample of sentence parts within each sampled book. Only the sampled
+parts are parsed and matched. Reports the per-pattern yield (tuples per 1000 sentence
+parts), and extrapolated full-corpus tuple counts and runtime, with 95% confidence
+intervals via a bootstrap over the sampled books within each stratum.
+
+A stratum whose share of the sample is below MIN_STRATUM_BOOKS is merged into its parent,
+i.e., its LoCC x era, then its LoCC, then one remainder stratum (see merge_strata), and
+each stratum is allocated at least MIN_STRATUM_BOOKS books, within --books in total (see
+allocate), s.t., each stratum contributes within-stratum variance.
+
+Book metadata is read from config["catalog"], e.g., "../book_urls_PS.csv" (see main.ipynb),
+where Text# is the book stem. Books not in the catalog fall in "unknown" strata.
+
+Note: extrapolation is by bytes within each stratum, i.e., a stratum's tuples, parts and
+seconds are taken as proportional to its size
+Note: a stratum with a single sampled book (e.g., a single member) is bootstrapped as per
+collapsed strata, i.e., its per-byte rate varies as the rates of the other such strata
+
+run:
+    python3 sample.py --books 100 --parts 50 --seed 0
+"""
+
+import argparse
+import json
+import pathlib
+import re
+import sys
+import typing
+import zlib
+from collections import Counter, defaultdict
+from multiprocessing import Pool
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+import Loaders.shards
+import pipeline
+from dedup import get_dropped
+
+# a LoCC (combination) holding fewer than this share of books is stratified as "other"
+MIN_LOCC_SHARE = 0.01
+
+# author era bucket width, in years
+ERA_YEARS = 50
+
+# the fewest books sampled per stratum, see merge_strata and allocate
+MIN_STRATUM_BOOKS = 2
+
+
+def main(args):
+
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--books", type=int, default=100, help="number of books sampled")
+    parser.add_argument("--parts", type=int, default=50, help="sentence parts sampled per book")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--bootstrap", type=int, default=1000, help="bootstrap replicates")
+    args = parser.parse_args(args)
+
+    # load configs
+    with open("configs.json", "r") as f:
+        configs: list[dict] = json.loads(f.read())
+
+    for config in configs:
+        if config["switch"] == True:
+
+            # get the strata of the input books, ignoring near-duplicates (see dedup.py)
+            dropped = get_dropped(config)
+            books = [book for book in pipeline.gen_input(config) if book.stem not in dropped]
+            strata = merge_strata(get_strata(books, config.get("catalog")), args.books)
+            sampled = draw_books(strata, args.books, seed=args.seed)
+            print(
+                f"{config['set']}: sampling {sum(len(fps) for fps in sampled.values())} of "
+                f"{len(books)} books, over {len(strata)} strata"
+            )
+
+            # parse and match the sampled parts of the sampled books only
+            tasks = [
+                ((config["set"], fp, 0, 1), args.parts, args.seed)
+                for fps in sampled.values()
+                for fp in fps
+            ]
+            with Pool(
+                int(config["n_processes"]),
+                initializer=pipeline.init_worker,
+                initargs=([config],),
+            ) as pool:
+                samples = dict(tqdm(pool.imap_unordered(sample_book, tasks), total=len(tasks)))
+
+            report = get_report(strata, sampled, samples, n_bootstrap=args.bootstrap, seed=args.seed)
+            print(format_report(report, n_processes=int(config["n_processes"])))
+
+
+def load_catalog(catalog_fp: typing.Union[str, None]) -> dict[str, tuple]:
+    """Return {stem: (locc, era)} wrt., the catalog csv at catalog_fp (if any)."""
+    if not catalog_fp:
+        return {}
+    df = pd.read_csv(pathlib.Path(catalog_fp).expanduser().resolve(), dtype=str).fillna("")
+    return {
+        stem: (locc if locc else "unknown", get_era(authors))
+        for stem, locc, authors in zip(df["Text#"], df["LoCC"], df["Authors"])
+    }
+
+
+def get_era(authors: str) -> str:
+    """Return e.g., '1800-1849' wrt., the first year of the first author,
+    e.g., 'Melville, Herman, 1819-1891; ...'"""
+    years = re.findall(r"\d{4}", authors.split(";")[0])
+    if len(years) == 0:
+        return "unknown"
+    start = int(years[0]) // ERA_YEARS * ERA_YEARS
+    return f"{start}-{start + ERA_YEARS - 1}"
+
+
+def get_strata(books: list, catalog_fp: typing.Union[str, None]) -> dict[tuple, list[tuple]]:
+    """Return {(locc, era, length quartile): [(fp, bytes), ...]} wrt., books."""
+    catalog = load_catalog(catalog_fp)
+    sizes = [pipeline.get_size(book) for book in books]
+    quartiles = np.quantile(sizes, [0.25, 0.5, 0.75]) if len(books) > 0 else []
+
+    meta = [catalog.get(book.stem, ("unknown", "unknown")) for book in books]
+    locc_counts = Counter(locc for locc, _ in meta)
+
+    strata = defaultdict(list)
+    for book, size, (locc, era) in zip(books, sizes, meta):
+        if locc_counts[locc] < MIN_LOCC_SHARE * len(books):
+            locc = "other"
+        length = f"q{np.searchsorted(quartiles, size, side='right') + 1}"
+        strata[(locc, era, length)].append((str(book), int(size)))
+    return dict(sorted(strata.items()))
+
+
+def merge_strata(strata: dict, n_books: int) -> dict[tuple, list[tuple]]:
+    """Return strata, where each sparse stratum (i.e., of fewer than MIN_STRATUM_BOOKS
+    members, or a proportional share of n_books below it) is merged into its parent, i.e.,
+    (locc, era, "all"), then (locc, "all", "all"), then ("all", "all", "all").
+
+    Note: a parent holds only the merged (sparse) strata beneath it
+    """
+    n_total = sum(len(members) for members in strata.values())
+
+    def is_sparse(members: list) -> bool:
+        share = n_books * len(members) / n_total if n_total > 0 else 0
+        return min(len(members), share) < MIN_STRATUM_BOOKS
+
+    merged = {}
+    pending = strata
+    for level in [2, 1, 0]:
+        parents = defaultdict(list)
+        for stratum, members in pending.items():
+            if is_sparse(members):
+                parents[stratum[:level] + ("all",) * (3 - level)] += members
+            else:
+                merged[stratum] = members
+        pending = parents
+    merged.update(pending)  # i.e., the remainder, however sparse
+    return dict(sorted(merged.items()))
+
+
+def allocate(strata: dict, n_books: int) -> dict[tuple, int]:
+    """Return {stratum: number of books to sample}, in proportion to the number of books in
+    each stratum (by largest remainder), at least MIN_STRATUM_BOOKS (or all) per stratum,
+    and at most n_books in total.
+
+    Note: where the minimum does not fit within n_books (i.e., more strata than n_books /
+    MIN_STRATUM_BOOKS), it is lowered
+    """
+    n_total = sum(len(members) for members in strata.values())
+    quota = {stratum: n_books * len(members) / n_total for stratum, members in strata.items()}
+    n = {
+        stratum: min(len(members), max(MIN_STRATUM_BOOKS, int(quota[stratum])))
+        for stratum, members in strata.items()
+    }
+
+    # i.e., take from the strata most above their quota
+    minimum = MIN_STRATUM_BOOKS
+    while sum(n.values()) > n_books:
+        over = [stratum for stratum in n if n[stratum] > minimum]
+        if len(over) == 0:
+            minimum -= 1
+            continue
+        n[max(over, key=lambda stratum: n[stratum] - quota[stratum])] -= 1
+
+    # i.e., give to the strata most below their quota
+    while sum(n.values()) < n_books:
+        under = [stratum for stratum in n if n[stratum] < len(strata[stratum])]
+        if len(under) == 0:
+            break
+        n[max(under, key=lambda stratum: quota[stratum] - n[stratum])] += 1
+    return n
+
+
+def draw_books(strata: dict, n_books: int, *, seed: int) -> dict[tuple, list[str]]:
+    """Return {stratum: [fp, ...]}, i.e., a sample of (at most) n_books, as per allocate."""
+    rng = np.random.default_rng(seed)
+    sampled = {}
+    for stratum, n in allocate(strata, n_books).items():
+        members = strata[stratum]
+        sampled[stratum] = [members[i][0] for i in sorted(rng.choice(len(members), n, replace=False))]
+    return sampled
+
+
+def sample_book(args: tuple) -> tuple:
+    """Return (fp, sample) wrt., a random sample of n_parts sentence parts of the task's
+    book, where sample holds the book's total parts, the number sampled, the tuple counts
+    per "role:pattern", and the seconds taken."""
+    task, n_parts, seed = args
+    _, df, stats = pipeline.load_chunk(task)
+
+    # Note: seeded wrt., the book, s.t., the sample does not depend on worker scheduling
+    stem = Loaders.shards.resolve(task[1]).stem
+    rng = np.random.default_rng([seed, zlib.crc32(stem.encode("utf-8"))])
+    idx = np.sort(rng.choice(len(df), size=min(n_parts, len(df)), replace=False))
+    attrs = df.attrs
+    df = df.iloc[idx]
+    df.attrs = attrs
+
+    *_, rows, stats = pipeline.match_chunk(pipeline.parse_chunk((task, df, stats)))
+    return task[1], {
+        "parts": stats["parts"],  # i.e., of the whole book
+        "sampled": len(df),
+        "counts": Counter(f"{row[4]}:{row[5]}" for row in rows),
+        "load_seconds": stats["seconds"]["load"],
+        "part_seconds": stats["seconds"]["parse"] + stats["seconds"]["match"],
+    }
+
+
+def get_report(
+    strata: dict, sampled: dict, samples: dict, *, n_bootstrap: int = 1000, seed: int = 0
+) -> dict:
+    """Return the sampled counts, and the extrapolated full-corpus parts, seconds and
+    tuples per "role:pattern", each as [estimate, 95% lower, 95% upper]."""
+
+    keys = sorted(set(key for sample in samples.values() for key in sample["counts"]))
+
+    # per stratum: its bytes, and a (books, [parts, seconds, tuples per key...]) matrix of the
+    # extrapolated totals of each sampled book, with the sampled books' bytes
+    rng = np.random.default_rng(seed)
+    estimate = np.zeros(2 + len(keys))
+    replicates = np.zeros((n_bootstrap, 2 + len(keys)))
+    singles = []  # i.e., (stratum bytes, per-byte rates) of strata of a single sampled book
+    rates = []  # i.e., the per-byte rates of all sampled books
+    for stratum, fps in sampled.items():
+        fps = [fp for fp in fps if fp in samples and samples[fp]["sampled"] > 0]
+        if len(fps) == 0:
+            continue
+        stratum_bytes = sum(size for _, size in strata[stratum])
+        fp2bytes = dict(strata[stratum])
+
+        V = np.zeros((len(fps), 2 + len(keys)))
+        B = np.array([fp2bytes[fp] for fp in fps], dtype=float)
+        for b, fp in enumerate(fps):
+            sample = samples[fp]
+            scale = sample["parts"] / sample["sampled"]
+            V[b, 0] = sample["parts"]
+            V[b, 1] = sample["load_seconds"] + sample["part_seconds"] * scale
+            V[b, 2:] = [sample["counts"].get(key, 0) * scale for key in keys]
+
+        if B.sum() == 0:
+            continue
+        estimate += stratum_bytes * V.sum(axis=0) / B.sum()
+        rates += [v / b for v, b in zip(V, B) if b > 0]
+        if len(fps) == 1:
+            singles.append((stratum_bytes, V[0] / B[0]))
+            continue
+
+        # i.e., resample the stratum's sampled books, with replacement
+        idx = rng.integers(0, len(fps), size=(n_bootstrap, len(fps)))
+        B_r = B[idx].sum(axis=1)
+        replicates += np.where(
+            B_r[:, None] > 0, stratum_bytes * V[idx].sum(axis=1) / np.maximum(B_r, 1)[:, None], 0
+        )
+
+    # i.e., collapsed strata: the rate of each single varies about its own as the rates of
+    # all singles vary about their mean (else, of all sampled books, for a lone single)
+    if len(singles) > 0:
+        pool = np.array([rate for _, rate in singles] if len(singles) > 1 else rates)
+        deviations = pool - pool.mean(axis=0)
+        idx = rng.integers(0, len(pool), size=(n_bootstrap, len(singles)))
+        for s, (stratum_bytes, rate) in enumerate(singles):
+            replicates += stratum_bytes * np.maximum(rate + deviations[idx[:, s]], 0)
+
+    def interval(x: float, x_r: np.ndarray) -> list[float]:
+        return [float(x), float(np.percentile(x_r, 2.5)), float(np.percentile(x_r, 97.5))]
+
+    parts_r = np.maximum(replicates[:, 0], 1)
+    report = {
+        "books": sum(len(members) for members in strata.values()),
+        "sampled_books": len(samples),
+        "sampled_parts": sum(sample["sampled"] for sample in samples.values()),
+        "strata": len(strata),
+        "parts": interval(estimate[0], replicates[:, 0]),
+        "seconds": interval(estimate[1], replicates[:, 1]),
+        "patterns": {},
+    }
+    for k, key in enumerate(keys, start=2):
+        report["patterns"][key] = {
+            "sampled": sum(sample["counts"].get(key, 0) for sample in samples.values()),
+            "per_1000_parts": interval(
+                1000 * estimate[k] / max(estimate[0], 1), 1000 * replicates[:, k] / parts_r
+            ),
+            "total": interval(estimate[k], replicates[:, k]),
+        }
+    return report
+
+
+def format_report(report: dict, *, n_processes: int = 1) -> str:
+    """Return the report as a table, with runtime as wall-clock hours over n_processes."""
+
+    def fmt(interval: list[float], spec: str = ".0f") -> str:
+        x, lo, hi = interval
+        return f"{x:{spec}} [{lo:{spec}}, {hi:{spec}}]"
+
+    lines = [
+        f"{report['sampled_parts']} sentence parts of {report['sampled_books']} of "
+        f"{report['books']} books, over {report['strata']} strata",
+        f"estimated sentence parts: {fmt(report['parts'])}",
+        f"estimated runtime: {fmt([s / 3600 / n_processes for s in report['seconds']], '.1f')} "
+        f"hours over {n_processes} processes",
+        "role:pattern\tsampled\tper 1000 parts\testimated total",
+    ]
+    for key, d in sorted(report["patterns"].items(), key=lambda x: -x[1]["total"][0]):
+        lines.append(f"{key}\t{d['sampled']}\t{fmt(d['per_1000_parts'], '.1f')}\t{fmt(d['total'])}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,117 @@
+"""
+a staged executor: a chain of stages, each run by its own thread(s), connected by
+bounded queues, s.t., e.g., reading the next book overlaps parsing the current one.
+
+E.g.,
+    stages = Stages(tasks, maxsize=2)
+    stages.add("load", load)
+    stages.add("parse", parse)
+    stages.add("match", match, n_threads=2)
+    for result in stages:
+        print(stages.depths())  # e.g., {"load": 2, "parse": 0, "match": 1, "out": 0}
+"""
+
+import queue
+import threading
+import typing
+
+# end of stream marker
+STOP = object()
+
+
+class Stages:
+    def __init__(self, source: typing.Iterable, *, maxsize: int = 2):
+        """A chain of stages, fed by iterating source (in its own thread).
+
+        Args:
+            source (typing.Iterable): the items fed to the first stage
+            maxsize (int): default bound of each stage's input queue
+        """
+        self.source = source
+        self.maxsize = maxsize
+        self.names: list[str] = []
+        self.queues: list[queue.Queue] = [queue.Queue(maxsize)]  # i.e., input of each stage
+        self.stages: list[tuple] = []
+        self.errors: list[BaseException] = []
+
+    def add(self, name: str, fn: typing.Callable, *, n_threads: int = 1, maxsize: int = None):
+        """Add a stage, applying fn to each item of the previous stage, in n_threads threads.
+
+        Note: fn returning None drops the item
+        Note: with n_threads > 1, items may leave the stage out of order
+        """
+        self.names.append(name)
+        self.stages.append((fn, n_threads))
+        self.queues.append(queue.Queue(self.maxsize if maxsize is None else maxsize))
+        return self
+
+    def depths(self) -> dict[str, int]:
+        """Return the current number of items waiting at the input of each stage, and
+        waiting to be consumed from the last stage ("out")."""
+        return {
+            name: q.qsize() for name, q in zip(self.names + ["out"], self.queues)
+        }
+
+    def __iter__(self) -> typing.Generator:
+        """Start the stage threads, and yield the outputs of the last stage."""
+
+        threads = [threading.Thread(target=self._feed, daemon=True)]
+        for stage_i, (fn, n_threads) in enumerate(self.stages):
+            remaining = [n_threads]  # i.e., threads of the stage still running
+            for _ in range(n_threads):
+                threads.append(
+                    threading.Thread(
+                        target=self._run,
+                        args=(fn, self.queues[stage_i], self.queues[stage_i + 1], remaining),
+                        daemon=True,
+                    )
+                )
+        for thread in threads:
+            thread.start()
+
+        while True:
+            item = self.queues[-1].get()
+            if item is STOP:
+                break
+            yield item
+
+        for thread in threads:
+            thread.join()
+
+        if self.errors:
+            raise self.errors[0]
+
+    def _feed(self):
+        try:
+            for item in self.source:
+                if self.errors:
+                    break
+                self.queues[0].put(item)
+        except BaseException as e:
+            self.errors.append(e)
+        self.queues[0].put(STOP)
+
+    def _run(self, fn, inbox: queue.Queue, outbox: queue.Queue, remaining: list[int]):
+        while True:
+            item = inbox.get()
+            if item is STOP:
+                inbox.put(STOP)  # i.e., for sibling threads of the stage
+                break
+            if self.errors:
+                continue  # i.e., drain
+            try:
+                result = fn(item)
+            except BaseException as e:
+                self.errors.append(e)
+                continue
+            if result is not None:
+                outbox.put(result)
+
+        # the last thread of the stage to finish, passes STOP on
+        with _stop_lock:
+            remaining[0] -= 1
+            if remaining[0] == 0:
+                outbox.put(STOP)
+
+
+_stop_lock = threading.Lock()
@@ -0,0 +1,150 @@
+""" per-task throughput telemetry for pipeline.py, as JSONL
+
+Each processed task (i.e., a book, or a chunk of a large book) appends one record to
+config["telemetry"], e.g.,
+    {"set": "PS", "book": "1234", "chunk_i": 0, "n_chunks": 1, "host": "node1", "worker": 2,
+     "bytes": 501234, "paragraphs": 1800, "parts": 9100, "tokens": 120345,
+     "seconds": {"load": 0.4, "parse": 61.2, "match": 3.1, "write": 0.02},
+     "tuples": {"adj": 2100, "agent": 1500, "patient": 900}, "peak_rss_mb": 1450.3,
+     "time": 1700000000.0}
+
+Note: "bytes" is the size of the whole book, "load" includes cleaning (done by the loader),
+and "peak_rss_mb" is the worker's peak resident set size so far
+
+Summarise, i.e., corpus-wide rates per stage and the slowest books:
+    python3 telemetry.py [--slowest 10]
+"""
+
+import argparse
+import json
+import pathlib
+import resource
+import socket
+import sys
+import threading
+from collections import defaultdict
+
+STAGES = ["load", "parse", "match", "write"]
+
+
+class Telemetry:
+    def __init__(self, fp: pathlib.Path):
+        """Append records to the JSONL file at fp (created if missing).
+
+        Note: usable from several threads of one process
+        """
+        self.fp = pathlib.Path(fp).expanduser().resolve()
+        self.fp.parent.mkdir(parents=True, exist_ok=True)
+        self.host = socket.gethostname()
+        self.lock = threading.Lock()
+
+    def record(self, record: dict):
+        line = json.dumps({"host": self.host, **record}) + "\n"
+        with self.lock, open(self.fp, "a", encoding="utf-8") as f:
+            f.write(line)
+
+
+def get_peak_rss_mb() -> float:
+    """Return the peak resident set size of this process, in MiB."""
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # i.e., KiB on linux, bytes on macOS
+    return max_rss / 2**20 if sys.platform == "darwin" else max_rss / 2**10
+
+
+def get_telemetry(config: dict) -> Telemetry:
+    return Telemetry(pathlib.Path(config.get("telemetry", "telemetry.jsonl")))
+
+
+def load_records(fp: pathlib.Path) -> list[dict]:
+    """Return the records at fp, ignoring any partially written (last) line."""
+    records = []
+    with open(fp, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                pass
+    return records
+
+
+def summarise(records: list[dict], *, n_slowest: int = 10) -> str:
+    """Return a report of the corpus-wide rates per stage, and the n_slowest books."""
+
+    totals = defaultdict(float)
+    seconds = defaultdict(float)
+    tuples = defaultdict(int)
+    books = defaultdict(lambda: defaultdict(float))  # (set, book) -> totals
+    peak_rss_mb = defaultdict(float)  # (host, worker) -> MiB
+
+    for record in records:
+        book = books[(record["set"], record["book"])]
+        book["bytes"] = record["bytes"]  # i.e., per book, not per chunk
+        for key in ["paragraphs", "parts", "tokens"]:
+            totals[key] += record[key]
+            book[key] += record[key]
+        for stage, s in record["seconds"].items():
+            seconds[stage] += s
+            book["seconds"] += s
+        for role, n in record["tuples"].items():
+            tuples[role] += n
+        key = (record["host"], record["worker"])
+        peak_rss_mb[key] = max(peak_rss_mb[key], record["peak_rss_mb"])
+    totals["bytes"] = sum(book["bytes"] for book in books.values())
+
+    lines = [
+        f"{len(books)} books, {len(records)} tasks: {totals['bytes'] / 2**20:.1f} MiB, "
+        f"{totals['paragraphs']:.0f} paragraphs, {totals['parts']:.0f} parts, "
+        f"{totals['tokens']:.0f} tokens",
+        f"tuples: {dict(tuples)}",
+        "stage\tseconds\tshare\ttokens/s\tMiB/s",
+    ]
+    total_seconds = sum(seconds.values())
+    for stage in STAGES:
+        s = seconds.get(stage, 0)
+        lines.append(
+            f"{stage}\t{s:.1f}\t{s / total_seconds if total_seconds else 0:.0%}"
+            f"\t{totals['tokens'] / s if s else 0:.0f}"
+            f"\t{totals['bytes'] / 2**20 / s if s else 0:.2f}"
+        )
+    if total_seconds:
+        lines.append(f"bottleneck: {max(STAGES, key=lambda stage: seconds.get(stage, 0))}")
+    if peak_rss_mb:
+        lines.append(f"peak RSS per worker: max {max(peak_rss_mb.values()):.0f} MiB")
+
+    lines.append(f"slowest {n_slowest} books:")
+    slowest = sorted(books.items(), key=lambda x: x[1]["seconds"], reverse=True)[:n_slowest]
+    for (set_name, stem), book in slowest:
+        lines.append(
+            f"\t{set_name}/{stem}\t{book['seconds']:.1f}s\t{book['bytes'] / 2**20:.2f} MiB"
+            f"\t{book['tokens'] / book['seconds'] if book['seconds'] else 0:.0f} tokens/s"
+        )
+    return "\n".join(lines)
+
+
+def main(args):
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--slowest", type=int, default=10, help="number of slowest books listed")
+    args = parser.parse_args(args)
+
+    # load configs
+    with open("configs.json", "r") as f:
+        configs: list[dict] = json.loads(f.read())
+
+    # i.e., configs may share one telemetry file
+    fp2sets = defaultdict(list)
+    for config in configs:
+        if config["switch"] == True:
+            fp2sets[get_telemetry(config).fp].append(config["set"])
+
+    for fp, set_names in fp2sets.items():
+        if not fp.exists():
+            print(f"{fp}: no telemetry")
+            continue
+        records = [record for record in load_records(fp) if record["set"] in set_names]
+        print(f"{fp} ({', '.join(set_names)})")
+        print(summarise(records, n_slowest=args.slowest))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,147 @@
+""" the per-book tuples output: columnar, dictionary-encoded JSONL, written in row groups
+
+output_dir/<book>.jsonl holds one JSON object per line:
+    * a header: {"format": "tuples", "version": 1, "book": <book>, "columns": COLUMNS}
+    * one line per row group: {"n_rows": n, "strings": [...], <col>: [...] for col in COLUMNS},
+      where the string cols (noun, feature, role, pattern) hold indices into the book's string
+      table, i.e., the concatenated "strings" of this and all preceding row groups
+    * a footer: {"n_rows": <total>, "n_row_groups": <count>}, i.e., absent if truncated
+
+Each row is a (noun, feature, role, pattern) tuple found in sentence part part_i of
+paragraph paragraph_i, whose [start, end) span in the loader's cleaned book body is
+start, end. part_i is -1 wrt., loaders returning whole paragraphs.
+"""
+
+import hashlib
+import os
+import pathlib
+import typing
+
+import orjson
+
+FORMAT = "tuples"
+VERSION = 1
+EXT = ".jsonl"
+
+COLUMNS = ["paragraph_i", "part_i", "noun", "feature", "role", "pattern", "start", "end"]
+STRING_COLUMNS = ["noun", "feature", "role", "pattern"]
+
+
+def get_output_fp(output_dir: pathlib.Path, stem: str) -> pathlib.Path:
+    return output_dir / f"{stem}{EXT}"
+
+
+class TupleWriter:
+    def __init__(self, fp: pathlib.Path, book: str):
+        """Write the rows of book to fp, one row group per add(), atomically, i.e., via a
+        temp file renamed to fp on close().
+
+        E.g.,
+            with TupleWriter(fp, "1234") as writer:
+                writer.add(rows)
+            output_hash = writer.output_hash
+        """
+        self.fp = pathlib.Path(fp)
+        self.tmp_fp = self.fp.with_name(f".{self.fp.name}.{os.getpid()}.tmp")
+        self.f = open(self.tmp_fp, "wb")
+        self.hash = hashlib.blake2b(digest_size=16)
+        self.string2i: dict[str, int] = {}
+        self.n_rows = 0
+        self.n_row_groups = 0
+        self.output_hash = None
+        self._write({"format": FORMAT, "version": VERSION, "book": book, "columns": COLUMNS})
+
+    def add(self, rows: list):
+        """Write rows, i.e., (paragraph_i, part_i, noun, feature, role, pattern, start, end)
+        tuples, as a row group."""
+        new_strings = []
+        cols = {col: [] for col in COLUMNS}
+        for row in rows:
+            for col, value in zip(COLUMNS, row):
+                if col in STRING_COLUMNS:
+                    i = self.string2i.get(value)
+                    if i is None:
+                        i = self.string2i[value] = len(self.string2i)
+                        new_strings.append(value)
+                    value = i
+                cols[col].append(value)
+
+        self._write({"n_rows": len(rows), "strings": new_strings, **cols})
+        self.n_rows += len(rows)
+        self.n_row_groups += 1
+
+    def close(self) -> str:
+        """Write the footer, and move the output into place. Return the output hash."""
+        self._write({"n_rows": self.n_rows, "n_row_groups": self.n_row_groups})
+        self.f.close()
+        os.replace(self.tmp_fp, self.fp)
+        self.output_hash = self.hash.hexdigest()
+        return self.output_hash
+
+    def abort(self):
+        self.f.close()
+        self.tmp_fp.unlink(missing_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def _write(self, obj: dict):
+        line = orjson.dumps(obj) + b"\n"
+        self.f.write(line)
+        self.hash.update(line)
+
+
+def read_columns(fp: pathlib.Path) -> dict[str, list]:
+    """Return {col: values} wrt., the output at fp, incl., a "book" col, with the string
+    cols decoded.
+
+    Raises ValueError if fp is not a complete output, e.g., truncated
+    """
+    encoded = read_encoded(fp)
+    strings = encoded.pop("strings")
+    for col in STRING_COLUMNS:
+        encoded[col] = [strings[i] for i in encoded[col]]
+    return encoded
+
+
+def read_encoded(fp: pathlib.Path) -> dict[str, list]:
+    """Return {col: values} wrt., the output at fp, incl., a "book" col, with the string
+    cols as indices into the "strings" entry, i.e., as stored.
+
+    Raises ValueError if fp is not a complete output, e.g., truncated
+    """
+    with open(fp, "rb") as f:
+        lines = f.read().splitlines()
+    if len(lines) < 2:
+        raise ValueError(f"{fp}: not a tuples output")
+
+    header = orjson.loads(lines[0])
+    footer = orjson.loads(lines[-1])
+    if header.get("format") != FORMAT or "n_row_groups" not in footer:
+        raise ValueError(f"{fp}: not a complete tuples output")
+
+    cols = {col: [] for col in header["columns"]}
+    strings = []
+    n_rows = 0
+    for line in lines[1:-1]:
+        row_group = orjson.loads(line)
+        strings += row_group["strings"]
+        for col in cols:
+            cols[col] += row_group[col]
+        n_rows += row_group["n_rows"]
+    if n_rows != footer["n_rows"] or len(lines) - 2 != footer["n_row_groups"]:
+        raise ValueError(f"{fp}: not a complete tuples output")
+
+    return {"book": [header["book"]] * n_rows, **cols, "strings": strings}
+
+
+def gen_rows(fp: pathlib.Path) -> typing.Generator:
+    """Return a generator of (book, paragraph_i, ..., end) rows wrt., the output at fp."""
+    cols = read_columns(fp)
+    yield from zip(*cols.values())